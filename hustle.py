@@ -16,12 +16,20 @@ def usage(white_help=True):
 	if white_help:
 		print(Fore.WHITE + "Subcommands are :-") 
 		print(Fore.WHITE + "    run    <filepath>    " + "         - interprete the program.")
+		print(Fore.WHITE + "    run    --engine=<engine> <filepath>" + " - interprete the program with tree (default), closure or vm engine.")
+		print(Fore.WHITE + "    run    --no-cache <filepath>" + "        - interprete the program without the parse cache.")
+		print(Fore.WHITE + "    run    --unbuffered <filepath>" + "      - write every line the program prints as it is printed.")
+		print(Fore.WHITE + "    run    --buffer-size=<bytes> <filepath>" + " - buffer the output of the program in <bytes> bytes.")
 		print(Fore.WHITE + "    com    <filepath>    " + "         - compile the program.")
 		print(Fore.WHITE + "    com -r <filepath>    " + "         - run the compiled program.")
 		print(Fore.WHITE + "    help                 " + "         - print this help screen.")
 	else: 
 		print("Subcommands are :-")
 		print("    run    <filepath>    " + "         - run will interprete the program.")
+		print("    run    --engine=<engine> <filepath>" + " - run will interprete the program with tree (default), closure or vm engine.")
+		print("    run    --no-cache <filepath>" + "        - run will interprete the program without the parse cache.")
+		print("    run    --unbuffered <filepath>" + "      - run will write every line the program prints as it is printed.")
+		print("    run    --buffer-size=<bytes> <filepath>" + " - run will buffer the output of the program in <bytes> bytes.")
 		print("    com    <filepath>    " + "         - compile the program.")
 		print("    com -r <filepath>	" + "         - run the compiled program.")
 		print("    help                 " + "         - help will print this help screen.")
@@ -40,6 +48,27 @@ def check_subcommand(command):
 		usage()
 
 
+def parse_run_flags():
+	# flags are removed from argv so Argv[] inside the program still sees the same arguments
+	while len(argv) > 2 and argv[2].startswith("--"):
+		flag = argv.pop(2)
+		if flag.startswith("--engine="):
+			engine = flag[len("--engine="):]
+			if engine not in stdlib.ENGINES:
+				throw_error("Unknown Engine " + engine, 1)
+			stdlib.engine = engine
+		elif flag == "--no-cache":
+			stdlib.use_cache = False
+		elif flag == "--unbuffered":
+			stdlib.output_buffer_size = 0
+		elif flag.startswith("--buffer-size="):
+			size = flag[len("--buffer-size="):]
+			if not size.isdigit() or int(size) == 0:
+				throw_error("Invalid Buffer Size " + size, 1)
+			stdlib.output_buffer_size = int(size)
+		else:
+			throw_error("Unknown Flag " + flag, 1)
+
 def throw_error(error, code):
 	print(Fore.RED + "ERROR: " + error)
 	usage()
@@ -54,14 +83,16 @@ def run():
 		throw_error("No Subcomand Provided", 1)
 	try:
 		if struct == "run":	
+			parse_run_flags()
+			stdlib.buffer_output(stdlib.output_buffer_size)
 			data = argv[2]
 			text = "run(\""+data+"\")"
 			result, error = stdlib.run('<stdin>', text)
 			if error:
 				print(error.as_string())
 			elif result:
-				if len(result.elements) == 1:
-					print(repr(result.elements[0]))
+				if result.length == 1:
+					print(repr(result.get(0)))
 				else:
 					print(repr(result)) 
 	except Exception as e:	
@@ -96,4 +127,8 @@ def run():
 		exit(0)
 
 if __name__ in '__main__':
-	run()
+	# the output is flushed before an exit prints its message to stderr
+	try:
+		run()
+	finally:
+		stdlib.flush_output()
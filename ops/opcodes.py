@@ -0,0 +1,30 @@
+OP_LOAD         = 0
+OP_STORE        = 1
+OP_NUMBER       = 2
+OP_STRING       = 3
+OP_NULL         = 4
+OP_POP          = 5
+OP_BINARY       = 6
+OP_NEGATE       = 7
+OP_NOT          = 8
+OP_PLUS         = 9
+OP_BUILD_LIST   = 10
+OP_JUMP         = 11
+OP_JUMP_IF_FALSE = 12
+OP_INTRINSIC    = 13
+OP_MAKE_FUNCTION = 14
+OP_CALL         = 15
+OP_RETURN       = 16
+OP_END_FUNCTION = 17
+OP_HALT         = 18
+OP_SETUP_WHILE  = 19
+OP_END_WHILE    = 20
+OP_SETUP_FOR    = 21
+OP_FOR_ITER     = 22
+OP_END_FOR      = 23
+OP_LOOP_APPEND  = 24
+OP_CONTINUE     = 25
+OP_BREAK        = 26
+OP_LOAD_INVARIANT = 27
+OP_KEEP_INVARIANT = 28
+OP_TAIL_CALL    = 29
@@ -1,8 +1,14 @@
 from functools import cached_property
+from bisect import bisect_right
+from collections import OrderedDict
+from array import array
 from arrow_strings.strings_with_arrows import *
 from keywords.keywords import *
 from ops.ops import *
+from ops.opcodes import *
 import string
+import re
+import gc
 import os
 import math
 from sys import *
@@ -11,6 +17,9 @@ import time
 import random
 import subprocess
 import shlex
+import hashlib
+import pickle
+import mmap
 from os import path
 
 # TODO: implement game of life in hustle
@@ -69,243 +78,192 @@ class RTError(Error):
 
     return 'Traceback (most recent call last):\n' + result
 
+class Source:
+  __slots__ = ('fn', 'text', 'line_starts')
+
+  def __init__(self, fn, text):
+    self.fn = fn
+    self.text = text
+    self.line_starts = None
+
+  def line_col(self, idx):
+    # the line table is only built once an error needs a line number
+    if self.line_starts is None:
+      self.line_starts = [0]
+      newline = self.text.find('\n')
+      while newline != -1:
+        self.line_starts.append(newline + 1)
+        newline = self.text.find('\n', newline + 1)
+
+    ln = bisect_right(self.line_starts, idx) - 1
+    return ln, idx - self.line_starts[ln]
+
 class Position:
-  def __init__(self, idx, ln, col, fn, ftxt):
+  __slots__ = ('idx', 'source')
+
+  def __init__(self, idx, source):
     self.idx = idx
-    self.ln = ln
-    self.col = col
-    self.fn = fn
-    self.ftxt = ftxt
+    self.source = source
 
-  def advance(self, current_char=None):
-    self.idx += 1
-    self.col += 1
+  @property
+  def ln(self):
+    return self.line_col()[0]
 
-    if current_char == '\n':
-      self.ln += 1
-      self.col = 0
+  @property
+  def col(self):
+    return self.line_col()[1]
 
-    return self
+  @property
+  def fn(self):
+    return self.source.fn
 
-  def copy(self):
-    return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+  @property
+  def ftxt(self):
+    return self.source.text
+
+  def line_col(self):
+    return self.source.line_col(self.idx)
+
+  def __reduce__(self):
+    return (type(self), (self.idx, self.source))
+
+class NewlineEndPosition(Position):
+  __slots__ = ()
+
+  # the end of a newline token is drawn one column past the end of its own line
+  def line_col(self):
+    ln, col = self.source.line_col(self.idx - 1)
+    return ln, col + 1
 
 
 class Token:
+  __slots__ = ('type', 'value', 'pos_start', 'pos_end')
+
   def __init__(self, type_, value=None, pos_start=None, pos_end=None):
     self.type = type_
     self.value = value
 
     if pos_start:
-      self.pos_start = pos_start.copy()
-      self.pos_end = pos_start.copy()
-      self.pos_end.advance()
-
-    if pos_end:
-      self.pos_end = pos_end.copy()
+      self.pos_start = pos_start
+      self.pos_end = pos_end or Position(pos_start.idx + 1, pos_start.source)
 
   def matches(self, type_, value):
     return self.type == type_ and self.value == value
+
+  def __reduce__(self):
+    return (Token, (self.type, self.value, self.pos_start, self.pos_end))
   
   def __repr__(self):
     if self.value: return f'{self.type}:{self.value}'
     return f'{self.type}'
 
 
+# every token the lexer knows is one alternative of a single pattern, tried in this order
+TOKEN_REGEX = re.compile(r"""
+   (?P<skip>[ \t]+|\#[^\n]*)
+  |(?P<newline>[;\n])
+  |(?P<number>[0-9]+(?:\.[0-9]*)?)
+  |(?P<identifier>[A-Za-z][A-Za-z0-9_]*)
+  |(?P<string>"[^"]*"?)
+  |(?P<operator>->|==|!=|<=|>=|[-+*%/^()\[\],=<>])
+  |(?P<not>!)
+""", re.VERBOSE)
+
+OPERATOR_TOKENS = {
+  '+' : TT_PLUS,
+  '-' : TT_MINUS,
+  '*' : TT_MUL,
+  '%' : TT_MOD,
+  '/' : TT_DIV,
+  '^' : TT_POW,
+  '(' : TT_LPAREN,
+  ')' : TT_RPAREN,
+  '[' : TT_LSQUARE,
+  ']' : TT_RSQUARE,
+  ',' : TT_COMMA,
+  '->': TT_ARROW,
+  '=' : TT_EQ,
+  '==': TT_EE,
+  '!=': TT_NE,
+  '<' : TT_LT,
+  '<=': TT_LTE,
+  '>' : TT_GT,
+  '>=': TT_GTE
+}
+
+# the token type of an identifier, keywords map straight to TT_KEYWORD
+IDENTIFIER_TOKENS = dict.fromkeys(KEYWORDS, TT_KEYWORD)
+
 class Lexer:
   def __init__(self, fn, text):
     self.fn = fn
     self.text = text
-    self.pos = Position(-1, 0, -1, fn, text)
-    self.current_char = None
-    self.advance()
-  
-  def advance(self):
-    self.pos.advance(self.current_char)
-    self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
+    self.source = Source(fn, text)
+    self.error = None
 
   def make_tokens(self):
-    tokens = []
-
-    while self.current_char != None:
-      if self.current_char in ' \t':
-        self.advance()
-      elif self.current_char == '#':
-        self.skip_comment()
-      elif self.current_char in ';\n':
-        tokens.append(Token(TT_NEWLINE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char in DIGITS:
-        tokens.append(self.make_number())
-      elif self.current_char in LETTERS:
-        tokens.append(self.make_identifier())
-      elif self.current_char == '"':
-        tokens.append(self.make_string())
-      elif self.current_char == '+':
-        tokens.append(Token(TT_PLUS, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '-':
-        tokens.append(self.make_minus_or_arrow())
-      elif self.current_char == '*':
-        tokens.append(Token(TT_MUL, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '%':
-        tokens.append(Token(TT_MOD, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '/':
-        tokens.append(Token(TT_DIV, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '^':
-        tokens.append(Token(TT_POW, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '(':
-        tokens.append(Token(TT_LPAREN, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == ')':
-        tokens.append(Token(TT_RPAREN, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '[':
-        tokens.append(Token(TT_LSQUARE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == ']':
-        tokens.append(Token(TT_RSQUARE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '!':
-        token, error = self.make_not_equals()
-        if error: return [], error
-        tokens.append(token)
-      elif self.current_char == '=':
-        tokens.append(self.make_equals())
-      elif self.current_char == '<':
-        tokens.append(self.make_less_than())
-      elif self.current_char == '>':
-        tokens.append(self.make_greater_than())
-      elif self.current_char == ',':
-        tokens.append(Token(TT_COMMA, pos_start=self.pos))
-        self.advance()
-      else:
-        pos_start = self.pos.copy()
-        char = self.current_char
-        self.advance()
-        return [], IllegalCharError(pos_start, self.pos, "'" + char + "'")
+    # tokens never reference each other, so a collection in the middle of lexing a large
+    # file would only walk the growing token list without ever finding garbage
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+      tokens = list(self.iter_tokens())
+    finally:
+      if gc_enabled: gc.enable()
 
-    tokens.append(Token(TT_EOF, pos_start=self.pos))
+    if self.error: return [], self.error
     return tokens, None
 
-  def make_number(self):
-    num_str = ''
-    dot_count = 0
-    pos_start = self.pos.copy()
-
-    while self.current_char != None and self.current_char in DIGITS + '.':
-      if self.current_char == '.':
-        if dot_count == 1: break
-        dot_count += 1
-      num_str += self.current_char
-      self.advance()
+  # yields the tokens one at a time so the parser can start before the whole file is lexed,
+  # an error is kept in self.error and ends the stream with an EOF token where it happened
+  def iter_tokens(self):
+    text = self.text
+    source = self.source
+    match = TOKEN_REGEX.match
+    idx = 0
 
-    if dot_count == 0:
-      return Token(TT_INT, int(num_str), pos_start, self.pos)
-    else:
-      return Token(TT_FLOAT, float(num_str), pos_start, self.pos)
+    while idx < len(text):
+      m = match(text, idx)
 
-  def make_string(self):
-    string = ''
-    pos_start = self.pos.copy()
-    escape_character = False
-    self.advance()
+      if not m:
+        self.error = IllegalCharError(Position(idx, source), Position(idx + 1, source), "'" + text[idx] + "'")
+        break
 
-    escape_characters = {
-      'n': '\n',
-      't': '\t'
-    }
-    while self.current_char != None and (self.current_char != '"' or escape_character):
-      if escape_character:
-        string += escape_characters.get(self.current_char, self.current_char)
+      kind = m.lastgroup
+      value = m.group()
+      end = m.end()
+
+      if kind == 'skip':
+        pass
+      elif kind == 'newline':
+        yield Token(TT_NEWLINE, pos_start=Position(idx, source), pos_end=NewlineEndPosition(end, source))
+      elif kind == 'number':
+        number = float(value) if '.' in value else int(value)
+        yield Token(TT_FLOAT if '.' in value else TT_INT, number, Position(idx, source), Position(end, source))
+      elif kind == 'identifier':
+        # names and strings are interned, so every use of the same name shares one str and
+        # comparing it against a symbol table key or a keyword is mostly an identity check
+        value = sys.intern(value)
+        yield Token(IDENTIFIER_TOKENS.get(value, TT_IDENTIFIER), value, Position(idx, source), Position(end, source))
+      elif kind == 'string':
+        # an unterminated string runs one past the end of the text, and a backslash only ever drops itself
+        if len(value) < 2 or value[-1] != '"':
+          value += '"'
+          end += 1
+        yield Token(TT_STRING, sys.intern(value[1:-1].replace('\\', '')), Position(idx, source), Position(end, source))
+      elif kind == 'operator':
+        yield Token(OPERATOR_TOKENS[value], pos_start=Position(idx, source), pos_end=Position(end, source))
       else:
-        if self.current_char == '\\':
-          escape_character = True
-        else:
-          string += self.current_char
-      self.advance()
-      escape_character = False
-    
-    self.advance()
-    return Token(TT_STRING, string, pos_start, self.pos)
-
-
-  def make_identifier(self):
-    id_str = ''
-    pos_start = self.pos.copy()
-
-    while self.current_char != None and self.current_char in LETTERS_DIGITS + '_':
-      id_str += self.current_char
-      self.advance()
-
-    tok_type = TT_KEYWORD if id_str in KEYWORDS else TT_IDENTIFIER
-    return Token(tok_type, id_str, pos_start, self.pos)
-
-  def make_minus_or_arrow(self):
-    tok_type = TT_MINUS
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '>':
-      self.advance()
-      tok_type = TT_ARROW
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_not_equals(self):
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      return Token(TT_NE, pos_start=pos_start, pos_end=self.pos), None
-
-    self.advance()
-    return None, ExpectedCharError(pos_start, self.pos, "'=' (after '!')")
-  
-  def make_equals(self):
-    tok_type = TT_EQ
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      tok_type = TT_EE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_less_than(self):
-    tok_type = TT_LT
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      tok_type = TT_LTE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_greater_than(self):
-    tok_type = TT_GT
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=': 
-      self.advance()
-      tok_type = TT_GTE
+        self.error = ExpectedCharError(Position(idx, source), Position(idx + 2, source), "'=' (after '!')")
+        break
 
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
+      idx = end
 
-  def skip_comment(self):
-    self.advance()
-    while self.current_char != '\n':
-      self.advance()
+    yield Token(TT_EOF, pos_start=Position(idx, source))
 
 class NumberNode:
+  __slots__ = ('tok', 'pos_start', 'pos_end')
+
   def __init__(self, tok):
     self.tok = tok
 
@@ -316,16 +274,22 @@ class NumberNode:
     return f'{self.tok}'
 
 class StringNode:
+  __slots__ = ('tok', 'value', 'pos_start', 'pos_end')
+
   def __init__(self, tok):
     self.tok = tok
 
     self.pos_start = self.tok.pos_start
     self.pos_end = self.tok.pos_end
+    # nothing changes a string value in place, so every evaluation returns this one
+    self.value = String(tok.value).set_pos(self.pos_start, self.pos_end)
 
   def __repr__(self):
     return f'{self.tok}'
 
 class ListNode:
+  __slots__ = ('element_nodes', 'pos_start', 'pos_end')
+
   def __init__(self, element_nodes, pos_start, pos_end):
     self.element_nodes = element_nodes
 
@@ -333,21 +297,31 @@ class ListNode:
     self.pos_end = pos_end
 
 class VarAccessNode:
+  __slots__ = ('var_name_tok', 'depth', 'slot', 'pos_start', 'pos_end')
+
   def __init__(self, var_name_tok):
     self.var_name_tok = var_name_tok
+    # filled in by the Resolver
+    self.depth = None
+    self.slot = None
 
     self.pos_start = self.var_name_tok.pos_start
     self.pos_end = self.var_name_tok.pos_end
 
 class VarAssignNode:
+  __slots__ = ('var_name_tok', 'value_node', 'slot', 'pos_start', 'pos_end')
+
   def __init__(self, var_name_tok, value_node):
     self.var_name_tok = var_name_tok
     self.value_node = value_node
+    self.slot = None
 
     self.pos_start = self.var_name_tok.pos_start
     self.pos_end = self.value_node.pos_end
 
 class BinOpNode:
+  __slots__ = ('left_node', 'op_tok', 'right_node', 'pos_start', 'pos_end')
+
   def __init__(self, left_node, op_tok, right_node):
     self.left_node = left_node
     self.op_tok = op_tok
@@ -360,6 +334,8 @@ class BinOpNode:
     return f'({self.left_node}, {self.op_tok}, {self.right_node})'
 
 class UnaryOpNode:
+  __slots__ = ('op_tok', 'node', 'pos_start', 'pos_end')
+
   def __init__(self, op_tok, node):
     self.op_tok = op_tok
     self.node = node
@@ -371,6 +347,8 @@ class UnaryOpNode:
     return f'({self.op_tok}, {self.node})'
 
 class IfNode:
+  __slots__ = ('cases', 'else_case', 'pos_start', 'pos_end')
+
   def __init__(self, cases, else_case):
     self.cases = cases
     self.else_case = else_case
@@ -379,6 +357,8 @@ class IfNode:
     self.pos_end = (self.else_case or self.cases[len(self.cases) - 1])[0].pos_end  
 
 class IncludeNode:
+  __slots__ = ('include_name', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, include_name, body_node, should_return_null):
     self.include_name = include_name
     self.body_node = body_node
@@ -388,6 +368,8 @@ class IncludeNode:
     self.pos_end = self.include_name.pos_end
 
 class MakeIntNode:
+  __slots__ = ('int_tok', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, int_tok, body_node, should_return_null):
     self.int_tok = int_tok
     self.body_node = body_node
@@ -397,6 +379,8 @@ class MakeIntNode:
     self.pos_end = self.int_tok.pos_end
 
 class MakeFloatNode:
+  __slots__ = ('float_tok', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, float_tok, body_node, should_return_null):
     self.float_tok = float_tok
     self.body_node = body_node
@@ -406,6 +390,8 @@ class MakeFloatNode:
     self.pos_end = self.float_tok.pos_end
 
 class MakeStrNode:
+  __slots__ = ('string_tok', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, string_tok, body_node, should_return_null):
     self.string_tok = string_tok
     self.body_node = body_node
@@ -415,6 +401,8 @@ class MakeStrNode:
     self.pos_end = self.string_tok.pos_end
 
 class ExitNode:
+  __slots__ = ('exit_code', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, exit_code, body_node, should_return_null):
     self.exit_code = exit_code
     self.body_node = body_node
@@ -424,6 +412,8 @@ class ExitNode:
     self.pos_end = self.exit_code.pos_end 
 
 class ArgvNode:
+  __slots__ = ('argv_count', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, argv_count, body_node, should_return_null):
     self.argv_count = argv_count
     self.body_node = body_node
@@ -433,6 +423,8 @@ class ArgvNode:
     self.pos_end = self.argv_count.pos_end 
 
 class ShuffleNode:
+  __slots__ = ('list_name', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, list_name, body_node, should_return_null):
     self.list_name = list_name
     self.body_node = body_node
@@ -442,6 +434,8 @@ class ShuffleNode:
     self.pos_end = self.list_name.pos_end
 
 class lenStrNode:
+  __slots__ = ('string_tok', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, string_tok, body_node, should_return_null):
     self.string_tok = string_tok
     self.body_node = body_node
@@ -451,6 +445,8 @@ class lenStrNode:
     self.pos_end = self.string_tok.pos_end
 
 class takeElementNode:
+  __slots__ = ('list_name', 'index_name', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, list_name, index_name, body_node, should_return_null):
     self.list_name = list_name
     self.index_name = index_name
@@ -461,6 +457,8 @@ class takeElementNode:
     self.pos_end   = self.index_name.pos_end
 
 class randIntNode:
+  __slots__ = ('first_rand_name', 'second_rand_name', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, first_rand_name, second_rand_name, body_node, should_return_null):
     self.first_rand_name = first_rand_name
     self.second_rand_name = second_rand_name
@@ -471,6 +469,8 @@ class randIntNode:
     self.pos_end   = self.second_rand_name.pos_end
 
 class SystemNode:
+  __slots__ = ('system_command_name', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, system_command_name, body_node, should_return_null):
     self.system_command_name = system_command_name
     self.body_node = body_node
@@ -479,7 +479,9 @@ class SystemNode:
     self.pos_start = self.system_command_name.pos_start
     self.pos_end = self.system_command_name.pos_end
 
-class SleepNode: 
+class SleepNode:
+  __slots__ = ('time_name', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
   def __init__(self, time_name, body_node, should_return_null):
     self.time_name = time_name
     self.body_node = body_node
@@ -489,6 +491,8 @@ class SleepNode:
     self.pos_end = self.time_name.pos_end
 
 class ForNode:
+  __slots__ = ('var_name_tok', 'start_value_node', 'end_value_node', 'step_value_node', 'body_node', 'should_return_null', 'slot', 'invariants', 'pos_start', 'pos_end')
+
   def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node, should_return_null):
     self.var_name_tok = var_name_tok
     self.start_value_node = start_value_node
@@ -496,26 +500,37 @@ class ForNode:
     self.step_value_node = step_value_node
     self.body_node = body_node
     self.should_return_null = should_return_null
+    self.slot = None
+    # filled in by the LoopHoister
+    self.invariants = []
 
     self.pos_start = self.var_name_tok.pos_start
     self.pos_end = self.body_node.pos_end
 
 
 class WhileNode:
+  __slots__ = ('condition_node', 'body_node', 'should_return_null', 'invariants', 'pos_start', 'pos_end')
+
   def __init__(self, condition_node, body_node, should_return_null):
     self.condition_node = condition_node
     self.body_node = body_node
     self.should_return_null = should_return_null
+    # filled in by the LoopHoister
+    self.invariants = []
 
     self.pos_start = self.condition_node.pos_start
     self.pos_end = self.body_node.pos_end
 
 class FuncDefNode:
+  __slots__ = ('var_name_tok', 'arg_name_toks', 'body_node', 'should_auto_return', 'slot', 'frame_layout', 'pos_start', 'pos_end')
+
   def __init__(self, var_name_tok, arg_name_toks, body_node, should_auto_return):
     self.var_name_tok = var_name_tok
     self.arg_name_toks = arg_name_toks
     self.body_node = body_node
     self.should_auto_return = should_auto_return
+    self.slot = None
+    self.frame_layout = None
 
     if self.var_name_tok:
       self.pos_start = self.var_name_tok.pos_start
@@ -527,6 +542,8 @@ class FuncDefNode:
     self.pos_end = self.body_node.pos_end
 
 class CallNode:
+  __slots__ = ('node_to_call', 'arg_nodes', 'pos_start', 'pos_end')
+
   def __init__(self, node_to_call, arg_nodes):
     self.node_to_call = node_to_call
     self.arg_nodes = arg_nodes
@@ -539,30 +556,55 @@ class CallNode:
       self.pos_end = self.node_to_call.pos_end
 
 class ReturnNode:
+  __slots__ = ('node_to_return', 'tail_call_body', 'pos_start', 'pos_end')
+
   def __init__(self, node_to_return, pos_start, pos_end):
     self.node_to_return = node_to_return
+    # filled in by the Resolver when this returns a call of the function it is in
+    self.tail_call_body = None
 
     self.pos_start = pos_start
     self.pos_end = pos_end
 
 
 class ContinueNode:
+  __slots__ = ('pos_start', 'pos_end')
+
   def __init__(self, pos_start, pos_end):
     self.pos_start = pos_start
     self.pos_end = pos_end
 
 class BreakNode:
+  __slots__ = ('pos_start', 'pos_end')
+
   def __init__(self, pos_start, pos_end):
     self.pos_start = pos_start
     self.pos_end = pos_end
 
+# made by the LoopHoister around an operation that gives the same value in every iteration
+# of a loop, the value is kept in a hidden slot of the frame after it is evaluated once
+# (top level code has no frame layout and keeps it in the invariants of its Context)
+class InvariantNode:
+  __slots__ = ('node', 'var_nodes', 'own_frame_only', 'slot', 'pos_start', 'pos_end')
+
+  def __init__(self, node, var_nodes, own_frame_only):
+    self.node = node
+    self.var_nodes = var_nodes
+    self.own_frame_only = own_frame_only
+    self.slot = None
+
+    self.pos_start = self.node.pos_start
+    self.pos_end = self.node.pos_end
+
+  def __repr__(self):
+    return f'{self.node}'
+
 class ParseResult:
   def __init__(self):
     self.error = None
     self.node = None
     self.last_registered_advance_count = 0
     self.advance_count = 0
-    self.to_reverse_count = 0
 
   def register_advancement(self):
     self.last_registered_advance_count = 1
@@ -574,12 +616,6 @@ class ParseResult:
     if res.error: self.error = res.error
     return res.node
 
-  def try_register(self, res):
-    if res.error:
-      self.to_reverse_count = res.advance_count
-      return None
-    return self.register(res)
-
   def success(self, node):
     self.node = node
     return self
@@ -589,25 +625,42 @@ class ParseResult:
       self.error = error
     return self
 
+# the tokens an expression or a statement can start with, the parser looks at the current
+# token to decide whether another one follows instead of trying to parse it and backing out
+EXPR_START_TYPES = (TT_INT, TT_FLOAT, TT_STRING, TT_IDENTIFIER, TT_PLUS, TT_MINUS, TT_LPAREN, TT_LSQUARE)
+EXPR_START_KEYWORDS = frozenset((
+  'var', 'not', 'if', 'for', 'while', 'func', 'include', 'Exit', 'make_str', 'make_int',
+  'make_float', 'Argv', 'randInt', 'takeElement', 'lenStr', 'Shuffle', 'system', 'sleep'
+))
+STATEMENT_START_KEYWORDS = EXPR_START_KEYWORDS | frozenset(('return', 'continue', 'break'))
+
 class Parser:
   def __init__(self, tokens):
-    self.tokens = tokens
-    self.tok_idx = -1
+    # tokens is a list or a stream from Lexer.iter_tokens, the parser never goes back so
+    # it only holds on to the current token
+    self.tokens = iter(tokens)
+    self.current_tok = None
     self.advance()
 
   def advance(self):
-    self.tok_idx += 1
-    self.update_current_tok()
+    # past the end of the tokens EOF stays the current token
+    self.current_tok = next(self.tokens, self.current_tok)
     return self.current_tok
 
-  def reverse(self, amount=1):
-    self.tok_idx -= amount
-    self.update_current_tok()
-    return self.current_tok
+  def starts_expr(self):
+    tok = self.current_tok
+    return tok.type in EXPR_START_TYPES or (tok.type == TT_KEYWORD and tok.value in EXPR_START_KEYWORDS)
+
+  # nothing reads the value of a statement in a block, so a loop there returns null and
+  # doesn't collect the values of its iterations into a list
+  def discard_value(self, statement):
+    if isinstance(statement, (ForNode, WhileNode)):
+      statement.should_return_null = True
+    return statement
 
-  def update_current_tok(self):
-    if self.tok_idx >= 0 and self.tok_idx < len(self.tokens):
-      self.current_tok = self.tokens[self.tok_idx]
+  def starts_statement(self):
+    tok = self.current_tok
+    return tok.type in EXPR_START_TYPES or (tok.type == TT_KEYWORD and tok.value in STATEMENT_START_KEYWORDS)
 
   def parse(self):
     res = self.statements()
@@ -621,7 +674,7 @@ class Parser:
   def statements(self):
     res = ParseResult()
     statements = []
-    pos_start = self.current_tok.pos_start.copy()
+    pos_start = self.current_tok.pos_start
 
     while self.current_tok.type == TT_NEWLINE:
       res.register_advancement()
@@ -629,9 +682,7 @@ class Parser:
 
     statement = res.register(self.statement())
     if res.error: return res
-    statements.append(statement)
-
-    more_statements = True
+    statements.append(self.discard_value(statement))
 
     while True:
       newline_count = 0
@@ -639,45 +690,42 @@ class Parser:
         res.register_advancement()
         self.advance()
         newline_count += 1
-      if newline_count == 0:
-        more_statements = False
-      
-      if not more_statements: break
-      statement = res.try_register(self.statement())
-      if not statement:
-        self.reverse(res.to_reverse_count)
-        more_statements = False
-        continue
-      statements.append(statement)
+
+      # statements are separated by newlines and nothing else can start one
+      if newline_count == 0 or not self.starts_statement(): break
+      statement = res.register(self.statement())
+      if res.error: return res
+      statements.append(self.discard_value(statement))
 
     return res.success(ListNode(
       statements,
       pos_start,
-      self.current_tok.pos_end.copy()
+      self.current_tok.pos_end
     ))
 
   def statement(self):
     res = ParseResult()
-    pos_start = self.current_tok.pos_start.copy()
+    pos_start = self.current_tok.pos_start
 
     if self.current_tok.matches(TT_KEYWORD, 'return'):
       res.register_advancement()
       self.advance()
 
-      expr = res.try_register(self.expr())
-      if not expr:
-        self.reverse(res.to_reverse_count)
-      return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start.copy()))
+      expr = None
+      if self.starts_expr():
+        expr = res.register(self.expr())
+        if res.error: return res
+      return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start))
     
     if self.current_tok.matches(TT_KEYWORD, 'continue'):
       res.register_advancement()
       self.advance()
-      return res.success(ContinueNode(pos_start, self.current_tok.pos_start.copy()))
+      return res.success(ContinueNode(pos_start, self.current_tok.pos_start))
 
     if self.current_tok.matches(TT_KEYWORD, 'break'):
       res.register_advancement()
       self.advance()
-      return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
+      return res.success(BreakNode(pos_start, self.current_tok.pos_start))
 
     expr = res.register(self.expr())
     if res.error:
@@ -937,7 +985,7 @@ class Parser:
   def list_expr(self):
     res = ParseResult()
     element_nodes = []
-    pos_start = self.current_tok.pos_start.copy()
+    pos_start = self.current_tok.pos_start
 
     if self.current_tok.type != TT_LSQUARE:
       return res.failure(InvalidSyntaxError(
@@ -978,7 +1026,7 @@ class Parser:
     return res.success(ListNode(
       element_nodes,
       pos_start,
-      self.current_tok.pos_end.copy()
+      self.current_tok.pos_end
     ))
 
   def if_expr(self):
@@ -1847,6 +1895,382 @@ class Parser:
 
     return res.success(left)
 
+def child_nodes(node):
+  if isinstance(node, ListNode):
+    return node.element_nodes
+  elif isinstance(node, VarAssignNode):
+    return [node.value_node]
+  elif isinstance(node, BinOpNode):
+    return [node.left_node, node.right_node]
+  elif isinstance(node, UnaryOpNode):
+    return [node.node]
+  elif isinstance(node, IfNode):
+    children = []
+    for condition, expr, _ in node.cases:
+      children += [condition, expr]
+    if node.else_case:
+      children.append(node.else_case[0])
+    return children
+  elif isinstance(node, ForNode):
+    children = [node.start_value_node, node.end_value_node]
+    if node.step_value_node:
+      children.append(node.step_value_node)
+    return children + [node.body_node]
+  elif isinstance(node, WhileNode):
+    return [node.condition_node, node.body_node]
+  elif isinstance(node, FuncDefNode):
+    return [node.body_node]
+  elif isinstance(node, CallNode):
+    return [node.node_to_call] + node.arg_nodes
+  elif isinstance(node, ReturnNode):
+    return [node.node_to_return] if node.node_to_return else []
+  elif isinstance(node, takeElementNode):
+    return [node.list_name, node.index_name]
+  elif isinstance(node, randIntNode):
+    return [node.first_rand_name, node.second_rand_name]
+  elif type(node) in INTRINSIC_OPERANDS:
+    # the body_node of an intrinsic is never executed
+    return [intrinsic_operand(node)]
+  return []
+
+# the same walk as child_nodes, but every child is replaced by what function returns for it
+def replace_child_nodes(node, function):
+  if isinstance(node, ListNode):
+    node.element_nodes = [function(element_node) for element_node in node.element_nodes]
+  elif isinstance(node, VarAssignNode):
+    node.value_node = function(node.value_node)
+  elif isinstance(node, BinOpNode):
+    node.left_node = function(node.left_node)
+    node.right_node = function(node.right_node)
+  elif isinstance(node, UnaryOpNode):
+    node.node = function(node.node)
+  elif isinstance(node, IfNode):
+    node.cases = [(function(condition), function(expr), should_return_null) for condition, expr, should_return_null in node.cases]
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      node.else_case = (function(expr), should_return_null)
+  elif isinstance(node, ForNode):
+    node.start_value_node = function(node.start_value_node)
+    node.end_value_node = function(node.end_value_node)
+    if node.step_value_node:
+      node.step_value_node = function(node.step_value_node)
+    node.body_node = function(node.body_node)
+  elif isinstance(node, WhileNode):
+    node.condition_node = function(node.condition_node)
+    node.body_node = function(node.body_node)
+  elif isinstance(node, FuncDefNode):
+    node.body_node = function(node.body_node)
+  elif isinstance(node, CallNode):
+    node.node_to_call = function(node.node_to_call)
+    node.arg_nodes = [function(arg_node) for arg_node in node.arg_nodes]
+  elif isinstance(node, ReturnNode):
+    if node.node_to_return:
+      node.node_to_return = function(node.node_to_return)
+  elif isinstance(node, takeElementNode):
+    node.list_name = function(node.list_name)
+    node.index_name = function(node.index_name)
+  elif isinstance(node, randIntNode):
+    node.first_rand_name = function(node.first_rand_name)
+    node.second_rand_name = function(node.second_rand_name)
+  elif type(node) in INTRINSIC_OPERANDS:
+    operand_name = INTRINSIC_OPERANDS[type(node)]
+    setattr(node, operand_name, function(getattr(node, operand_name)))
+
+INTRINSIC_OPERANDS = {
+  ArgvNode: 'argv_count',
+  ExitNode: 'exit_code',
+  MakeFloatNode: 'float_tok',
+  MakeIntNode: 'int_tok',
+  MakeStrNode: 'string_tok',
+  IncludeNode: 'include_name',
+  SleepNode: 'time_name',
+  SystemNode: 'system_command_name',
+  ShuffleNode: 'list_name',
+  lenStrNode: 'string_tok',
+}
+
+def intrinsic_operand(node):
+  return getattr(node, INTRINSIC_OPERANDS[type(node)])
+
+# the resolver binds variables inside of functions to slots of an array backed frame.
+# hustle is dynamically scoped (the parent of a call is the context of the caller), so
+# only the frame of the function itself is known before running the program:
+#   depth 0 -> the name is assigned in this function, read the slot and fall back to the
+#              callers when it has not been assigned yet
+#   depth 1 -> the name is never assigned in this function, start looking in the caller
+# top level code runs in the global symbol table which include() keeps changing, so it
+# stays unresolved (depth None)
+class Resolver:
+  def __init__(self):
+    self.frame_layout = None
+
+  def resolve(self, node):
+    if isinstance(node, FuncDefNode):
+      self.resolve_function(node)
+      return
+
+    if self.frame_layout is not None:
+      if isinstance(node, VarAccessNode):
+        slot = self.frame_layout.get(node.var_name_tok.value)
+        node.depth = 1 if slot is None else 0
+        node.slot = slot
+      elif isinstance(node, (VarAssignNode, ForNode)):
+        node.slot = self.frame_layout[node.var_name_tok.value]
+
+    for child in child_nodes(node):
+      self.resolve(child)
+
+  def resolve_function(self, node):
+    if node.var_name_tok and self.frame_layout is not None:
+      node.slot = self.frame_layout[node.var_name_tok.value]
+
+    frame_layout = {}
+    for arg_name_tok in node.arg_name_toks:
+      frame_layout.setdefault(arg_name_tok.value, len(frame_layout))
+    self.collect_locals(node.body_node, frame_layout)
+    node.frame_layout = frame_layout
+
+    enclosing_layout = self.frame_layout
+    self.frame_layout = frame_layout
+    self.resolve(node.body_node)
+    self.frame_layout = enclosing_layout
+
+    if node.var_name_tok:
+      self.mark_tail_calls(node.body_node, node)
+
+  # a return of a call to the function itself by its name can run the body again in the
+  # same frame, the engines still check at run time that the name means this function
+  def mark_tail_calls(self, node, func_node):
+    if isinstance(node, FuncDefNode):
+      return
+
+    if isinstance(node, ReturnNode) and isinstance(node.node_to_return, CallNode):
+      node_to_call = node.node_to_return.node_to_call
+      if isinstance(node_to_call, VarAccessNode) and node_to_call.var_name_tok.value == func_node.var_name_tok.value:
+        node.tail_call_body = func_node.body_node
+
+    for child in child_nodes(node):
+      self.mark_tail_calls(child, func_node)
+
+  def collect_locals(self, node, frame_layout):
+    if isinstance(node, (VarAssignNode, ForNode)):
+      frame_layout.setdefault(node.var_name_tok.value, len(frame_layout))
+    elif isinstance(node, FuncDefNode):
+      if node.var_name_tok:
+        frame_layout.setdefault(node.var_name_tok.value, len(frame_layout))
+      return
+
+    for child in child_nodes(node):
+      self.collect_locals(child, frame_layout)
+
+# the optimizer folds operations on literals into a single literal and drops the cases of
+# an if that can never run. an operation is only folded when evaluating it succeeds, so
+# errors (like a division by zero) still happen at run time with the same message
+MAX_FOLDED_STRING = 4096
+
+class Optimizer:
+  def optimize(self, node):
+    replace_child_nodes(node, self.optimize)
+    method = getattr(self, f'fold_{type(node).__name__}', None)
+    return method(node) if method else node
+
+  def fold_BinOpNode(self, node):
+    left = literal_value(node.left_node)
+    right = literal_value(node.right_node)
+    if left is None or right is None: return node
+
+    method_name = binary_operation(node.op_tok)
+    # huge powers and repeated strings would be computed here even when the code never runs
+    if method_name == 'powed_by' and isinstance(right.value, (int, float)) and abs(right.value) > 64: return node
+    if method_name == 'multed_by' and isinstance(left, String) and isinstance(right.value, int):
+      if len(left.value) * right.value > MAX_FOLDED_STRING: return node
+
+    try:
+      result, error = getattr(left, method_name)(right)
+    except Exception:
+      return node
+    if error: return node
+
+    return literal_node(result, node) or node
+
+  def fold_UnaryOpNode(self, node):
+    number = literal_value(node.node)
+    if number is None: return node
+
+    try:
+      if node.op_tok.type == TT_MINUS:
+        result, error = number.multed_by(Number(-1))
+      elif node.op_tok.matches(TT_KEYWORD, 'not'):
+        result, error = number.notted()
+      else:
+        result, error = number, None
+    except Exception:
+      return node
+    if error: return node
+
+    return literal_node(result, node) or node
+
+  def fold_IfNode(self, node):
+    cases = []
+    dead_case = None
+    for case in node.cases:
+      condition = case[0]
+
+      if isinstance(condition, NumberNode) and condition.tok.value == 0:
+        # a dead case is only kept when there is nothing else, an IfNode needs one case
+        if dead_case is None: dead_case = case
+        continue
+
+      cases.append(case)
+      if isinstance(condition, NumberNode):
+        # the cases after a condition that is always true and the else case can't run
+        node.else_case = None
+        break
+
+    node.cases = cases or [dead_case]
+    return node
+
+def literal_value(node):
+  if isinstance(node, NumberNode): return Number(node.tok.value)
+  if isinstance(node, StringNode): return String(node.tok.value)
+  return None
+
+def literal_node(value, node):
+  if type(value) is Number and type(value.value) in (int, float):
+    tok_type = TT_INT if type(value.value) is int else TT_FLOAT
+    return NumberNode(Token(tok_type, value.value, node.pos_start, node.pos_end))
+  if type(value) is String and type(value.value) is str and len(value.value) <= MAX_FOLDED_STRING:
+    return StringNode(Token(TT_STRING, value.value, node.pos_start, node.pos_end))
+  return None
+
+# the loop hoister finds operations inside of a loop that give the same value in every
+# iteration because none of their variables is assigned by the loop. they are wrapped in an
+# InvariantNode which is evaluated the first time the loop reaches it (so errors still
+# happen in the same place) and then read back from a hidden slot of the frame, the slots
+# are cleared every time the loop starts and again when it is done.
+# hustle is dynamically scoped and a call can run() a script that changes the globals, so
+# in a loop that calls anything only variables of the function's own frame are trusted
+class LoopHoister:
+  def __init__(self):
+    self.function = None
+
+  def hoist(self, node):
+    if isinstance(node, FuncDefNode):
+      enclosing_function = self.function
+      self.function = node
+      self.hoist(node.body_node)
+      self.function = enclosing_function
+      return
+
+    if isinstance(node, (ForNode, WhileNode)):
+      self.hoist_loop(node)
+
+    for child in child_nodes(node):
+      self.hoist(child)
+
+  def hoist_loop(self, loop):
+    self.loop = loop
+    self.assigned = set()
+    self.makes_calls = False
+
+    if isinstance(loop, ForNode):
+      self.assigned.add(loop.var_name_tok.value)
+      self.collect_assignments(loop.body_node)
+      loop.body_node = self.hoist_operations(loop.body_node)
+    else:
+      self.collect_assignments(loop.condition_node)
+      self.collect_assignments(loop.body_node)
+      loop.condition_node = self.hoist_operations(loop.condition_node)
+      loop.body_node = self.hoist_operations(loop.body_node)
+
+  def collect_assignments(self, node):
+    if isinstance(node, (VarAssignNode, ForNode)):
+      self.assigned.add(node.var_name_tok.value)
+    elif isinstance(node, (CallNode, IncludeNode)):
+      self.makes_calls = True
+    elif isinstance(node, FuncDefNode):
+      # the body runs in its own frame
+      if node.var_name_tok: self.assigned.add(node.var_name_tok.value)
+      return
+
+    for child in child_nodes(node):
+      self.collect_assignments(child)
+
+  def hoist_operations(self, node):
+    if isinstance(node, (InvariantNode, FuncDefNode)):
+      return node
+
+    if isinstance(node, (BinOpNode, UnaryOpNode)):
+      var_nodes = []
+      if self.is_invariant(node, var_nodes) and var_nodes:
+        return self.make_invariant(node, var_nodes)
+
+    replace_child_nodes(node, self.hoist_operations)
+    return node
+
+  def is_invariant(self, node, var_nodes):
+    if isinstance(node, (NumberNode, StringNode)):
+      return True
+    elif isinstance(node, VarAccessNode):
+      if node.var_name_tok.value in self.assigned: return False
+      if self.makes_calls and node.depth != 0: return False
+      var_nodes.append(node)
+      return True
+    elif isinstance(node, BinOpNode):
+      return self.is_invariant(node.left_node, var_nodes) and self.is_invariant(node.right_node, var_nodes)
+    elif isinstance(node, UnaryOpNode):
+      return self.is_invariant(node.node, var_nodes)
+    return False
+
+  def make_invariant(self, node, var_nodes):
+    invariant = InvariantNode(node, var_nodes, self.makes_calls)
+
+    # top level code keeps the value in the invariants of its context under the node itself
+    if self.function:
+      frame_layout = self.function.frame_layout
+      invariant.slot = frame_layout[invariant] = len(frame_layout)
+
+    self.loop.invariants.append(invariant)
+    return invariant
+
+def invariant_value(node, context):
+  if node.slot is not None:
+    return context.symbol_table.slots[node.slot]
+  return context.invariants.get(node) if context.invariants else None
+
+def keep_invariant(node, value, context):
+  # a list can be changed in place while the loop runs, so the value is only kept when it
+  # and every variable it was made from is a number or a string
+  if type(value) is not Number and type(value) is not String: return
+
+  symbol_table = context.symbol_table
+  for var_node in node.var_nodes:
+    var_name = var_node.var_name_tok.value
+
+    if node.own_frame_only:
+      operand = symbol_table.slots[var_node.slot]
+    elif var_node.depth == 0:
+      operand = symbol_table.get_slot(var_node.slot, var_name)
+    elif var_node.depth == 1:
+      operand = symbol_table.get_parent(var_name)
+    else:
+      operand = symbol_table.get(var_name)
+
+    if type(operand) is not Number and type(operand) is not String: return
+
+  if node.slot is not None:
+    symbol_table.slots[node.slot] = value
+  else:
+    if context.invariants is None: context.invariants = {}
+    context.invariants[node] = value
+
+def reset_invariants(invariants, context):
+  for node in invariants:
+    if node.slot is not None:
+      context.symbol_table.slots[node.slot] = None
+    elif context.invariants:
+      context.invariants.pop(node, None)
+
 class RTResult:
   def __init__(self):
     self.reset()
@@ -1898,10 +2322,57 @@ class RTResult:
       self.loop_should_break
     )
 
+# the closure compiler does not pass RTResults around, it uses these exceptions to
+# unwind the python stack on errors, returns, continues and breaks instead
+class RTFailure(Exception):
+  def __init__(self, error):
+    self.error = error
+
+class ReturnSignal(Exception):
+  def __init__(self, value):
+    self.value = value
+
+# returned by a tail call to the function it is made in instead of calling it. the function
+# puts the args into its own frame and runs its body again, the other slots keep their
+# values: with dynamic scoping that is what the new call would have found in its caller
+class TailCall:
+  __slots__ = ('args', 'pos_start', 'pos_end')
+
+  def __init__(self, args, pos_start, pos_end):
+    self.args = args
+    self.pos_start = pos_start
+    self.pos_end = pos_end
+
+class ContinueSignal(Exception):
+  pass
+
+class BreakSignal(Exception):
+  pass
+
+def raise_result(res):
+  if res.error: raise RTFailure(res.error)
+  if res.func_return_value: raise ReturnSignal(res.func_return_value)
+  if res.loop_should_continue: raise ContinueSignal()
+  if res.loop_should_break: raise BreakSignal()
+
+def run_code(code, context):
+  res = RTResult()
+  try:
+    return res.success(code(context))
+  except RTFailure as failure:
+    return res.failure(failure.error)
+  except ReturnSignal as signal:
+    return res.success_return(signal.value)
+  except ContinueSignal:
+    return res.success_continue()
+  except BreakSignal:
+    return res.success_break()
+
 class Value:
   def __init__(self):
-    self.set_pos()
-    self.set_context()
+    self.pos_start = None
+    self.pos_end = None
+    self.context = None
 
   def set_pos(self, pos_start=None, pos_end=None):
     self.pos_start = pos_start
@@ -1957,6 +2428,11 @@ class Value:
   def execute(self, args):
     return RTResult().failure(self.illegal_operation())
 
+  # what a call site runs: the callable is given the position and context of the call,
+  # Function overrides this to skip copying itself for every call
+  def call(self, args, context, pos_start, pos_end):
+    return self.copy().set_pos(pos_start, pos_end).set_context(context).execute(args)
+
   def copy(self):
     raise Exception('No copy method defined')
 
@@ -2088,19 +2564,80 @@ class Number(Value):
   def __repr__(self):
     return str(self.value)
 
+# numbers never change once made, so the small integers every loop counter, index and
+# comparison produces are made once and shared
+SMALL_NUMBERS = [Number(i) for i in range(-5, 257)]
+
+def make_number(value):
+  if type(value) is int and -5 <= value <= 256:
+    return SMALL_NUMBERS[value + 5]
+  return Number(value)
+
 Number.null = Number("\n")
-Number.false = Number(0)
-Number.true = Number(1)
+Number.false = make_number(0)
+Number.true = make_number(1)
 Number.math_PI = Number(math.pi)
 
+# the operations between two Numbers by method name, for the engines to skip the type
+# checks of the methods. None means the method has to report an error (division by zero)
+NUMBER_OPERATIONS = {
+  'added_to'          : lambda a, b: make_number(a + b),
+  'subbed_by'         : lambda a, b: make_number(a - b),
+  'multed_by'         : lambda a, b: make_number(a * b),
+  'moded_by'          : lambda a, b: make_number(a % b),
+  'dived_by'          : lambda a, b: make_number(a / b) if b != 0 else None,
+  'powed_by'          : lambda a, b: make_number(a ** b),
+  'get_comparison_eq' : lambda a, b: Number.true if a == b else Number.false,
+  'get_comparison_ne' : lambda a, b: Number.true if a != b else Number.false,
+  'get_comparison_lt' : lambda a, b: Number.true if a < b else Number.false,
+  'get_comparison_gt' : lambda a, b: Number.true if a > b else Number.false,
+  'get_comparison_lte': lambda a, b: Number.true if a <= b else Number.false,
+  'get_comparison_gte': lambda a, b: Number.true if a >= b else Number.false,
+  'anded_by'          : lambda a, b: make_number(int(a and b)),
+  'ored_by'           : lambda a, b: make_number(int(a or b))
+}
+
+# a string made by + keeps the strings it is made of as pieces and only joins them when its
+# characters are needed (printing, comparing, indexing...). like the storage of a list the
+# pieces can be shared: every string only sees the first `count` of them, and adding to a
+# string that nothing was added after yet appends to the pieces in place, so building a
+# string with `var s = s + x` in a loop is linear instead of quadratic
 class String(Value):
   def __init__(self, value):
     super().__init__()
-    self.value = value
+    self.text = value
+    self.pieces = None
+    self.count = 0
+
+  @classmethod
+  def joined(cls, pieces, count):
+    string = cls(None)
+    string.pieces = pieces
+    string.count = count
+    return string
+
+  @property
+  def value(self):
+    if self.text is None:
+      pieces = self.pieces
+      self.text = ''.join(pieces if len(pieces) == self.count else pieces[:self.count])
+    return self.text
+
+  @value.setter
+  def value(self, value):
+    self.text = value
+    self.pieces = None
+    self.count = 0
 
   def added_to(self, other):
     if isinstance(other, String):
-      return String(self.value + other.value).set_context(self.context), None
+      pieces = self.pieces
+      if pieces is None:
+        pieces = [self.value]
+      elif len(pieces) != self.count:
+        pieces = pieces[:self.count]
+      pieces.append(other.value)
+      return String.joined(pieces, len(pieces)).set_context(self.context), None
     else:
       return None, Value.illegal_operation(self, other)
       
@@ -2125,7 +2662,9 @@ class String(Value):
     return self.value > 0
 
   def copy(self):
-    copy = String(self.value)
+    copy = String(self.text)
+    copy.pieces = self.pieces
+    copy.count = self.count
     copy.set_pos(self.pos_start, self.pos_end)
     copy.set_context(self.context)
     return copy
@@ -2136,21 +2675,212 @@ class String(Value):
   def __repr__(self):
     return f'"{self.value}"'
 
+# a string read from a memory-mapped file: it is only a start and end in the mapping until
+# its characters are needed, and then only its own bytes are decoded
+class MappedString(String):
+  def __init__(self, mapping, start, end):
+    super().__init__(None)
+    self.mapping = mapping
+    self.start = start
+    self.end = end
+
+  @property
+  def value(self):
+    if self.text is None:
+      self.text = self.mapping[self.start:self.end].decode('utf-8', 'replace')
+    return self.text
+
+  def copy(self):
+    copy = MappedString(self.mapping, self.start, self.end)
+    copy.text = self.text
+    copy.set_pos(self.pos_start, self.pos_end)
+    copy.set_context(self.context)
+    return copy
+
+# a file opened by the open builtin. in mode "m" the file is memory-mapped instead of read:
+# read, readline and readlines return MappedStrings, so nothing is copied out of the file
+# before it is used. a mapped string can only be decoded once something reads it, where a
+# decoding error can't be reported, so every mode replaces bytes that are not utf-8
+class File(Value):
+  def __init__(self, path, mode, handle, mapping=None):
+    super().__init__()
+    self.path = path
+    self.mode = mode
+    self.handle = handle
+    self.mapping = mapping
+
+  def read(self):
+    mapping = self.mapping
+    if mapping is None: return String(self.handle.read())
+
+    start = mapping.tell()
+    mapping.seek(0, os.SEEK_END)
+    return MappedString(mapping, start, mapping.tell())
+
+  def readline(self):
+    mapping = self.mapping
+    if mapping is None:
+      line = self.handle.readline()
+      if not line: return None
+      return String(line[:-1] if line.endswith('\n') else line)
+
+    start = mapping.tell()
+    if start == len(mapping): return None
+    end = mapping.find(b'\n', start)
+    if end == -1:
+      end = len(mapping)
+      mapping.seek(end)
+    else:
+      mapping.seek(end + 1)
+    return MappedString(mapping, start, end)
+
+  def readlines(self):
+    if self.mapping is None:
+      return [String(line) for line in self.handle.read().splitlines()]
+
+    lines = []
+    line = self.readline()
+    while line is not None:
+      lines.append(line)
+      line = self.readline()
+    return lines
+
+  def write(self, text):
+    self.handle.write(text)
+
+  def close(self):
+    # MappedStrings keep using the mapping, it is unmapped once the last of them is gone
+    if self.mapping is None: self.handle.close()
+    self.handle = self.mapping = None
+
+  def is_true(self):
+    return True
+
+  def copy(self):
+    copy = File(self.path, self.mode, self.handle, self.mapping)
+    copy.set_pos(self.pos_start, self.pos_end)
+    copy.set_context(self.context)
+    return copy
+
+  def __repr__(self):
+    return f'<file "{self.path}" mode "{self.mode}">'
+
+FILE_MODES = {'r': 'r', 'w': 'w', 'a': 'a', 'm': 'rb'}
+
+def open_file(path, mode):
+  if mode != 'm': return File(path, mode, open(path, FILE_MODES[mode], encoding='utf-8', errors='replace'))
+
+  with open(path, FILE_MODES[mode]) as handle:
+    try:
+      mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+      # an empty file can't be mapped, there is nothing to copy out of it anyway
+      return File(path, mode, open(path, 'r', encoding='utf-8', errors='replace'))
+  return File(path, mode, mapping, mapping)
+
+# a list keeps its elements in a storage that the lists made from it by + can share: every
+# list only sees the first `length` elements of it. adding to a list that nothing was added
+# after yet appends to the storage in place (so `var l = l + x` in a loop is amortized O(1))
+# and anything else copies it first. changing elements in place (append, pop, extend and
+# shuffle) copies the storage when other lists may still see it, so a list never changes
+# because of another one. lists of only integers (that fit in 64 bits) or only floats keep
+# their numbers unboxed in an array('q') or array('d')
 class List(Value):
   def __init__(self, elements):
     super().__init__()
-    self.elements = elements
+    if type(elements) is not list and type(elements) is not array:
+      elements = list(elements)
+    self.storage = pack_elements(elements)
+    self.length = len(self.storage)
+    # true when other lists may see the start of the same storage
+    self.shared = False
+
+  @classmethod
+  def sharing(cls, storage, length):
+    new_list = cls.__new__(cls)
+    Value.__init__(new_list)
+    new_list.storage = storage
+    new_list.length = length
+    new_list.shared = True
+    return new_list
+
+  def get(self, index):
+    if index < 0: index += self.length
+    if not 0 <= index < self.length: raise IndexError('list index out of range')
+    element = self.storage[index]
+    return make_number(element) if type(self.storage) is array else element
+
+  def values(self):
+    storage = self.storage
+    if type(storage) is array:
+      return [make_number(element) for element in storage[:self.length]]
+    return storage[:self.length]
+
+  def with_elements(self, elements):
+    storage = self.storage
+    if len(storage) != self.length:
+      storage = storage[:self.length]
+
+    new_storage = storage
+    for element in elements:
+      new_storage = storage_append(new_storage, element)
+
+    new_list = List.sharing(new_storage, self.length + len(elements))
+    if new_storage is self.storage:
+      self.shared = True
+    else:
+      new_list.shared = False
+    return new_list
+
+  def own_storage(self):
+    if self.shared or len(self.storage) != self.length:
+      self.storage = self.storage[:self.length]
+      self.shared = False
+    return self.storage
+
+  def append(self, element):
+    # appending after the end of what other lists see can't change them
+    if len(self.storage) != self.length: self.own_storage()
+
+    storage = storage_append(self.storage, element)
+    if storage is not self.storage:
+      self.storage = storage
+      self.shared = False
+    self.length += 1
+
+  def extend(self, other):
+    for element in other.values():
+      self.append(element)
+
+  def pop(self, index):
+    storage = self.own_storage()
+    element = storage.pop(index)
+    self.length -= 1
+    return make_number(element) if type(storage) is array else element
+
+  def shuffle(self):
+    random.shuffle(self.own_storage())
+
+  def numbers(self):
+    # the raw numbers of a list of only numbers, None when something else is in it
+    storage = self.storage
+    if type(storage) is array:
+      return storage if len(storage) == self.length else storage[:self.length]
+
+    numbers = []
+    for element in storage[:self.length]:
+      if type(element) is not Number or type(element.value) not in (int, float): return None
+      numbers.append(element.value)
+    return numbers
 
   def added_to(self, other):
-    new_list = self.copy()
-    new_list.elements.append(other)
-    return new_list, None
+    return self.with_elements([other]), None
 
   def subbed_by(self, other):
     if isinstance(other, Number):
-      new_list = self.copy()
+      new_list = List(self.values())
       try:
-        new_list.elements.pop(other.value)
+        new_list.pop(other.value)
         return new_list, None
       except:
         return None, RTError(
@@ -2163,24 +2893,20 @@ class List(Value):
 
   def multed_by(self, other):
     if isinstance(other, List):
-      new_list = self.copy()
-      new_list.elements.extend(other.elements)
-      return new_list, None
+      return self.with_elements(other.values()), None
     else:
       return None, Value.illegal_operation(self, other)
   
   def moded_by(self, other):
     if isinstance(other, List):
-      new_list = self.copy()
-      new_list.elements.extend(other.elements)
-      return new_list, None
+      return self.with_elements(other.values()), None
     else:
       return None, Value.illegal_operation(self, other)
 
   def dived_by(self, other):
     if isinstance(other, Number):
       try:
-        return self.elements[other.value], None
+        return self.get(other.value), None
       except:
         return None, RTError(
           other.pos_start, other.pos_end,
@@ -2191,16 +2917,54 @@ class List(Value):
       return None, Value.illegal_operation(self, other)
   
   def copy(self):
-    copy = List(self.elements)
+    # the copy sees the same elements, both of them copy the storage before changing it
+    self.shared = True
+    copy = List.sharing(self.storage, self.length)
     copy.set_pos(self.pos_start, self.pos_end)
     copy.set_context(self.context)
     return copy
 
   def __str__(self):
-    return ", ".join([str(x) for x in self.elements])
+    return ", ".join([str(x) for x in self.values()])
 
   def __repr__(self):
-    return f'[{", ".join([repr(x) for x in self.elements])}]'
+    return f'[{", ".join([repr(x) for x in self.values()])}]'
+
+NUMBER_STORAGE = {int: 'q', float: 'd'}
+
+def pack_elements(elements):
+  if type(elements) is not list or not elements or type(elements[0]) is not Number:
+    return elements
+
+  value_type = type(elements[0].value)
+  typecode = NUMBER_STORAGE.get(value_type)
+  if typecode is None: return elements
+
+  for element in elements:
+    if type(element) is not Number or type(element.value) is not value_type:
+      return elements
+
+  try:
+    return array(typecode, [element.value for element in elements])
+  except OverflowError:
+    return elements
+
+# appends in place when it can, a number array turns into a list of values when the
+# element doesn't fit in it
+def storage_append(storage, element):
+  if type(storage) is array:
+    if type(element) is Number and NUMBER_STORAGE.get(type(element.value)) == storage.typecode:
+      try:
+        storage.append(element.value)
+        return storage
+      except OverflowError:
+        pass
+    storage = [make_number(value) for value in storage]
+  elif not storage:
+    return pack_elements([element])
+
+  storage.append(element)
+  return storage
 
 class BaseFunction(Value):
   def __init__(self, name):
@@ -2235,7 +2999,6 @@ class BaseFunction(Value):
     for i in range(len(args)):
       arg_name = arg_names[i]
       arg_value = args[i]
-      arg_value.set_context(exec_ctx)
       exec_ctx.symbol_table.set(arg_name, arg_value)
 
   def check_and_populate_args(self, arg_names, args, exec_ctx):
@@ -2245,29 +3008,99 @@ class BaseFunction(Value):
     self.populate_args(arg_names, args, exec_ctx)
     return res.success(None)
 
+# the most frames a function keeps for its next calls after they return
+FRAME_POOL_SIZE = 16
+
 class Function(BaseFunction):
-  def __init__(self, name, body_node, arg_names, should_auto_return):
+  def __init__(self, name, body_node, arg_names, should_auto_return, frame_layout=None):
     super().__init__(name)
     self.body_node = body_node
     self.arg_names = arg_names
     self.should_auto_return = should_auto_return
-
-  def execute(self, args):
+    self.frame_layout = frame_layout
+    # worked out once here instead of on every call
+    self.arity = len(arg_names)
+    self.arg_slots = [frame_layout[arg_name] for arg_name in arg_names] if frame_layout is not None else None
+    self.free_frames = []
+    self.empty_slots = (None,) * len(frame_layout) if frame_layout is not None else None
+
+  def call(self, args, context, pos_start, pos_end):
     res = RTResult()
-    interpreter = Interpreter() 
-    exec_ctx = self.generate_new_context()
 
-    res.register(self.check_and_populate_args(self.arg_names, args, exec_ctx))
-    if res.should_return(): return res
+    if len(args) != self.arity:
+      return res.failure(self.arity_error(args, context, pos_start, pos_end))
+
+    exec_ctx = self.enter_frame(args, context, pos_start)
 
-    value = res.register(interpreter.visit(self.body_node, exec_ctx))
+    value = res.register(self.run_body(exec_ctx))
+    while type(res.func_return_value) is TailCall:
+      tail_call = res.func_return_value
+      if len(tail_call.args) != self.arity:
+        return res.failure(self.arity_error(tail_call.args, exec_ctx, tail_call.pos_start, tail_call.pos_end))
+      self.populate_frame(tail_call.args, exec_ctx)
+
+      value = res.register(self.run_body(exec_ctx))
     if res.should_return() and res.func_return_value == None: return res
 
+    self.leave_frame(exec_ctx)
     ret_value = (value if self.should_auto_return else None) or res.func_return_value or Number.null
     return res.success(ret_value)
 
+  def execute(self, args):
+    return self.call(args, self.context, self.pos_start, self.pos_end)
+
+  def run_body(self, exec_ctx):
+    return tree_interpreter.visit(self.body_node, exec_ctx)
+
+  def arity_error(self, args, context, pos_start, pos_end):
+    if len(args) > self.arity:
+      details = f"{len(args) - self.arity} too many args passed into {self}"
+    else:
+      details = f"{self.arity - len(args)} too few args passed into {self}"
+    return RTError(pos_start, pos_end, details, context)
+
+  # a frame is a Context with the FrameSymbolTable of one call. frames of calls that
+  # returned are kept (with their slot list cleared in place) and handed to the next call,
+  # a frame is never kept after an error since the traceback of the error still walks
+  # through it
+  def enter_frame(self, args, context, pos_start):
+    if self.frame_layout is None:
+      exec_ctx = Context(self.name, context, pos_start)
+      exec_ctx.symbol_table = SymbolTable(context.symbol_table)
+      self.populate_args(self.arg_names, args, exec_ctx)
+      return exec_ctx
+
+    if self.free_frames:
+      exec_ctx = self.free_frames.pop()
+      exec_ctx.parent = context
+      exec_ctx.parent_entry_pos = pos_start
+      symbol_table = exec_ctx.symbol_table
+      symbol_table.parent = context.symbol_table
+    else:
+      exec_ctx = Context(self.name, context, pos_start)
+      exec_ctx.symbol_table = FrameSymbolTable(self.frame_layout, context.symbol_table)
+
+    self.populate_frame(args, exec_ctx)
+    return exec_ctx
+
+  def populate_frame(self, args, exec_ctx):
+    if self.arg_slots is None:
+      self.populate_args(self.arg_names, args, exec_ctx)
+      return
+
+    slots = exec_ctx.symbol_table.slots
+    for slot, arg in zip(self.arg_slots, args):
+      slots[slot] = arg
+
+  def leave_frame(self, exec_ctx):
+    if self.frame_layout is not None and len(self.free_frames) < FRAME_POOL_SIZE:
+      symbol_table = exec_ctx.symbol_table
+      symbol_table.slots[:] = self.empty_slots
+      symbol_table.symbols = None
+      self.free_frames.append(exec_ctx)
+
   def copy(self):
-    copy = Function(self.name, self.body_node, self.arg_names, self.should_auto_return)
+    copy = Function(self.name, self.body_node, self.arg_names, self.should_auto_return, self.frame_layout)
     copy.set_context(self.context)
     copy.set_pos(self.pos_start, self.pos_end)
     return copy
@@ -2275,52 +3108,156 @@ class Function(BaseFunction):
   def __repr__(self):
     return f"<function {self.name}>"
 
-class BuiltInFunction(BaseFunction):
-  def __init__(self, name):
-    super().__init__(name)
+class CompiledFunction(Function):
+  def __init__(self, name, body_node, arg_names, should_auto_return, frame_layout, body_code):
+    super().__init__(name, body_node, arg_names, should_auto_return, frame_layout)
+    self.body_code = body_code
 
-  def execute(self, args):
+  def run_body(self, exec_ctx):
     res = RTResult()
-    exec_ctx = self.generate_new_context()
-
-    method_name = f'execute_{self.name}'
-    method = getattr(self, method_name, self.no_visit_method)
-
-    res.register(self.check_and_populate_args(method.arg_names, args, exec_ctx))
-    if res.should_return(): return res
 
-    return_value = res.register(method(exec_ctx))
-    if res.should_return(): return res
-    return res.success(return_value)
-  
-  def no_visit_method(self, node, context):
-    raise Exception(f'No execute_{self.name} method defined')
+    try:
+      return res.success(self.body_code(exec_ctx))
+    except ReturnSignal as signal:
+      return res.success_return(signal.value)
+    except RTFailure as failure:
+      return res.failure(failure.error)
+    except ContinueSignal:
+      return res.success_continue()
+    except BreakSignal:
+      return res.success_break()
 
   def copy(self):
-    copy = BuiltInFunction(self.name)
+    copy = CompiledFunction(self.name, self.body_node, self.arg_names, self.should_auto_return, self.frame_layout, self.body_code)
     copy.set_context(self.context)
     copy.set_pos(self.pos_start, self.pos_end)
     return copy
 
-  def __repr__(self):
-    return f"<built-in function {self.name}>"
+class VMFunction(Function):
+  def __init__(self, name, body_node, arg_names, should_auto_return, frame_layout, code):
+    super().__init__(name, body_node, arg_names, should_auto_return, frame_layout)
+    self.code = code
 
+  def call(self, args, context, pos_start, pos_end):
+    if len(args) != self.arity:
+      return RTResult().failure(self.arity_error(args, context, pos_start, pos_end))
 
-  def execute_print(self, exec_ctx):
-    print(str(exec_ctx.symbol_table.get('value')))
-    return RTResult().success(Number.null)
-  execute_print.arg_names = ['value']
-  
+    exec_ctx = self.enter_frame(args, context, pos_start)
+    return VM().execute(Frame(self.code, exec_ctx, function=self))
+
+  def copy(self):
+    copy = VMFunction(self.name, self.body_node, self.arg_names, self.should_auto_return, self.frame_layout, self.code)
+    copy.set_context(self.context)
+    copy.set_pos(self.pos_start, self.pos_end)
+    return copy
+
+# the most results a memoized function keeps, the least recently used one is dropped first
+MEMO_CACHE_SIZE = 4096
+
+# made by memoize(f): calls with the same numbers and strings as args give the result of
+# the first of them without running f again, f has to be pure for that to be right
+class MemoizedFunction(BaseFunction):
+  def __init__(self, function):
+    super().__init__(function.name)
+    self.function = function
+    self.cache = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def call(self, args, context, pos_start, pos_end):
+    key = memo_key(args)
+
+    if key is not None:
+      value = self.cache.get(key)
+      if value is not None:
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return RTResult().success(value)
+
+    self.misses += 1
+    res = self.function.call(args, context, pos_start, pos_end)
+    if res.should_return(): return res
+
+    # a list can be changed in place, so only numbers and strings are kept
+    if key is not None and type(res.value) in (Number, String):
+      self.cache[key] = res.value
+      if len(self.cache) > MEMO_CACHE_SIZE:
+        self.cache.popitem(last=False)
+
+    return res
+
+  def execute(self, args):
+    return self.call(args, self.context, self.pos_start, self.pos_end)
+
+  def stats(self):
+    calls = self.hits + self.misses
+    hit_rate = self.hits / calls * 100 if calls else 0
+    return f"hits: {self.hits}, misses: {self.misses}, cached: {len(self.cache)}/{MEMO_CACHE_SIZE}, hit rate: {hit_rate:.2f}%"
+
+  def copy(self):
+    # the copy shares the cache, it is still the same memoized function
+    copy = MemoizedFunction.__new__(MemoizedFunction)
+    copy.__dict__.update(self.__dict__)
+    return copy
+
+  def __repr__(self):
+    return f"<memoized function {self.name}>"
+
+def memo_key(args):
+  key = []
+  for arg in args:
+    if type(arg) is not Number and type(arg) is not String: return None
+    key.append((type(arg), type(arg.value), arg.value))
+  return tuple(key)
+
+class BuiltInFunction(BaseFunction):
+  def __init__(self, name):
+    super().__init__(name)
+
+  def execute(self, args):
+    res = RTResult()
+    exec_ctx = self.generate_new_context()
+
+    method_name = f'execute_{self.name}'
+    method = getattr(self, method_name, self.no_visit_method)
+
+    res.register(self.check_and_populate_args(method.arg_names, args, exec_ctx))
+    if res.should_return(): return res
+
+    return_value = res.register(method(exec_ctx))
+    if res.should_return(): return res
+    return res.success(return_value)
+  
+  def no_visit_method(self, node, context):
+    raise Exception(f'No execute_{self.name} method defined')
+
+  def copy(self):
+    copy = BuiltInFunction(self.name)
+    copy.set_context(self.context)
+    copy.set_pos(self.pos_start, self.pos_end)
+    return copy
+
+  def __repr__(self):
+    return f"<built-in function {self.name}>"
+
+
+  def execute_print(self, exec_ctx):
+    sys.stdout.write(str(exec_ctx.symbol_table.get('value')) + '\n')
+    return RTResult().success(Number.null)
+  execute_print.arg_names = ['value']
+  
   def execute_print_ret(self, exec_ctx):
     return RTResult().success(String(str(exec_ctx.symbol_table.get('value'))))
   execute_print_ret.arg_names = ['value']
   
   def execute_input(self, exec_ctx):
+    flush_output()
     text = input()
     return RTResult().success(String(text))
   execute_input.arg_names = []
 
   def execute_input_int(self, exec_ctx):
+    flush_output()
     text = input()
     try:
       number = int(text)
@@ -2330,11 +3267,162 @@ class BuiltInFunction(BaseFunction):
     return RTResult().success(Number(number))
   execute_input_int.arg_names = []
 
+  # reading stdin in bulk. read_line streams it a line at a time and returns null once it
+  # is used up, a failed read or bad data is a runtime error instead of an exit
+  def read_stdin(self, exec_ctx, read):
+    flush_output()
+    try:
+      return read(), None
+    except (OSError, UnicodeDecodeError) as e:
+      return None, RTError(
+        self.pos_start, self.pos_end,
+        f"Could not read stdin: {e}",
+        exec_ctx
+      )
+
+  def execute_read_all(self, exec_ctx):
+    text, error = self.read_stdin(exec_ctx, sys.stdin.read)
+    if error: return RTResult().failure(error)
+    return RTResult().success(String(text))
+  execute_read_all.arg_names = []
+
+  def execute_read_lines(self, exec_ctx):
+    lines, error = self.read_stdin(exec_ctx, lambda: sys.stdin.read().splitlines())
+    if error: return RTResult().failure(error)
+    return RTResult().success(List([String(line) for line in lines]))
+  execute_read_lines.arg_names = []
+
+  def execute_read_line(self, exec_ctx):
+    line, error = self.read_stdin(exec_ctx, sys.stdin.readline)
+    if error: return RTResult().failure(error)
+    if not line: return RTResult().success(Number.null)
+    return RTResult().success(String(line[:-1] if line.endswith('\n') else line))
+  execute_read_line.arg_names = []
+
+  def execute_read_ints(self, exec_ctx):
+    words, error = self.read_stdin(exec_ctx, lambda: sys.stdin.read().split())
+    if error: return RTResult().failure(error)
+
+    numbers = []
+    for word in words:
+      try:
+        numbers.append(int(word))
+      except ValueError:
+        return RTResult().failure(RTError(
+          self.pos_start, self.pos_end,
+          f"Expected integers on stdin, got '{word}'",
+          exec_ctx
+        ))
+
+    try:
+      elements = array('q', numbers)
+    except OverflowError:
+      elements = [make_number(number) for number in numbers]
+    return RTResult().success(List(elements))
+  execute_read_ints.arg_names = []
+
+  def execute_open(self, exec_ctx):
+    path = exec_ctx.symbol_table.get("path")
+    mode = exec_ctx.symbol_table.get("mode")
+
+    if not isinstance(path, String):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be string",
+        exec_ctx
+      ))
+
+    if not isinstance(mode, String) or mode.value not in FILE_MODES:
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        'Second argument must be "r", "w", "a" or "m"',
+        exec_ctx
+      ))
+
+    try:
+      file = open_file(path.value, mode.value)
+    except OSError as e:
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        f'Could not open "{path.value}": {e.strerror}',
+        exec_ctx
+      ))
+
+    return RTResult().success(file)
+  execute_open.arg_names = ["path", "mode"]
+
+  # runs operation on the file argument, a closed file or a failed read or write is a
+  # runtime error
+  def file_operation(self, exec_ctx, operation):
+    file = exec_ctx.symbol_table.get("file")
+
+    if not isinstance(file, File):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be file",
+        exec_ctx
+      ))
+
+    if file.handle is None:
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        f'File "{file.path}" is closed',
+        exec_ctx
+      ))
+
+    try:
+      return RTResult().success(operation(file))
+    except (OSError, ValueError, UnicodeDecodeError) as e:
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        f'Could not use file "{file.path}": {e}',
+        exec_ctx
+      ))
+
+  def execute_read(self, exec_ctx):
+    return self.file_operation(exec_ctx, File.read)
+  execute_read.arg_names = ["file"]
+
+  def execute_readline(self, exec_ctx):
+    def readline(file):
+      line = file.readline()
+      return Number.null if line is None else line
+    return self.file_operation(exec_ctx, readline)
+  execute_readline.arg_names = ["file"]
+
+  def execute_readlines(self, exec_ctx):
+    return self.file_operation(exec_ctx, lambda file: List(file.readlines()))
+  execute_readlines.arg_names = ["file"]
+
+  def execute_write(self, exec_ctx):
+    value = exec_ctx.symbol_table.get("value")
+
+    def write(file):
+      if file.mode not in ('w', 'a'):
+        raise ValueError(f'not opened for writing (mode "{file.mode}")')
+      file.write(str(value))
+      return Number.null
+    return self.file_operation(exec_ctx, write)
+  execute_write.arg_names = ["file", "value"]
+
+  def execute_close(self, exec_ctx):
+    def close(file):
+      file.close()
+      return Number.null
+    return self.file_operation(exec_ctx, close)
+  execute_close.arg_names = ["file"]
+
   def execute_clear(self, exec_ctx):
+    flush_output()
     os.system('cls' if os.name == 'nt' else 'clear') 
     return RTResult().success(Number.null)
   execute_clear.arg_names = []
 
+  def execute_flush(self, exec_ctx):
+    flush_output()
+    return RTResult().success(Number.null)
+  execute_flush.arg_names = []
+
   def execute_is_number(self, exec_ctx):
     is_number = isinstance(exec_ctx.symbol_table.get("value"), Number)
     return RTResult().success(Number.true if is_number else Number.false)
@@ -2366,7 +3454,7 @@ class BuiltInFunction(BaseFunction):
         exec_ctx
       ))
 
-    list_.elements.append(value)
+    list_.append(value)
     return RTResult().success(Number.null)
   execute_append.arg_names = ["list", "value"]
 
@@ -2389,7 +3477,7 @@ class BuiltInFunction(BaseFunction):
       ))
 
     try:
-      element = list_.elements.pop(index.value)
+      element = list_.pop(index.value)
     except:
       return RTResult().failure(RTError(
         self.pos_start, self.pos_end,
@@ -2417,7 +3505,7 @@ class BuiltInFunction(BaseFunction):
         exec_ctx
       ))
 
-    listA.elements.extend(listB.elements)
+    listA.extend(listB)
     return RTResult().success(Number.null)
   execute_extend.arg_names = ["listA", "listB"]
 
@@ -2431,9 +3519,190 @@ class BuiltInFunction(BaseFunction):
         exec_ctx
       ))
       
-    return RTResult().success(Number(len(list_.elements)))
+    return RTResult().success(Number(list_.length))
   execute_len.arg_names = ["list"]
 
+  # the list builtins run their loop in python, lists of numbers are handled as arrays
+  def execute_map(self, exec_ctx):
+    res = RTResult()
+    list_ = exec_ctx.symbol_table.get("list")
+    function = exec_ctx.symbol_table.get("function")
+
+    if not isinstance(list_, List):
+      return res.failure(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be list",
+        exec_ctx
+      ))
+
+    if not isinstance(function, BaseFunction):
+      return res.failure(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be function",
+        exec_ctx
+      ))
+
+    elements = []
+    for element in list_.values():
+      elements.append(res.register(function.call([element], exec_ctx, self.pos_start, self.pos_end)))
+      if res.should_return(): return res
+
+    return res.success(List(elements))
+  execute_map.arg_names = ["list", "function"]
+
+  def execute_filter(self, exec_ctx):
+    res = RTResult()
+    list_ = exec_ctx.symbol_table.get("list")
+    function = exec_ctx.symbol_table.get("function")
+
+    if not isinstance(list_, List):
+      return res.failure(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be list",
+        exec_ctx
+      ))
+
+    if not isinstance(function, BaseFunction):
+      return res.failure(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be function",
+        exec_ctx
+      ))
+
+    elements = []
+    for element in list_.values():
+      keep = res.register(function.call([element], exec_ctx, self.pos_start, self.pos_end))
+      if res.should_return(): return res
+
+      if not isinstance(keep, Number):
+        return res.failure(RTError(
+          self.pos_start, self.pos_end,
+          "Predicate must return a number",
+          exec_ctx
+        ))
+      if keep.is_true(): elements.append(element)
+
+    return res.success(List(elements))
+  execute_filter.arg_names = ["list", "function"]
+
+  def execute_reduce(self, exec_ctx):
+    res = RTResult()
+    list_ = exec_ctx.symbol_table.get("list")
+    function = exec_ctx.symbol_table.get("function")
+    value = exec_ctx.symbol_table.get("initial")
+
+    if not isinstance(list_, List):
+      return res.failure(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be list",
+        exec_ctx
+      ))
+
+    if not isinstance(function, BaseFunction):
+      return res.failure(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be function",
+        exec_ctx
+      ))
+
+    for element in list_.values():
+      value = res.register(function.call([value, element], exec_ctx, self.pos_start, self.pos_end))
+      if res.should_return(): return res
+
+    return res.success(value)
+  execute_reduce.arg_names = ["list", "function", "initial"]
+
+  def execute_sum(self, exec_ctx):
+    list_ = exec_ctx.symbol_table.get("list")
+
+    if not isinstance(list_, List):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "Argument must be list",
+        exec_ctx
+      ))
+
+    numbers = list_.numbers()
+    if numbers is None:
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "List must only contain numbers",
+        exec_ctx
+      ))
+
+    return RTResult().success(make_number(sum(numbers)))
+  execute_sum.arg_names = ["list"]
+
+  def execute_range(self, exec_ctx):
+    start = exec_ctx.symbol_table.get("start")
+    end = exec_ctx.symbol_table.get("end")
+
+    if not isinstance(start, Number) or not isinstance(end, Number) or type(start.value) is not int or type(end.value) is not int:
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "Arguments must be integers",
+        exec_ctx
+      ))
+
+    try:
+      elements = array('q', range(start.value, end.value))
+    except OverflowError:
+      elements = [make_number(i) for i in range(start.value, end.value)]
+    return RTResult().success(List(elements))
+  execute_range.arg_names = ["start", "end"]
+
+  def execute_sort(self, exec_ctx):
+    list_ = exec_ctx.symbol_table.get("list")
+
+    if not isinstance(list_, List):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "Argument must be list",
+        exec_ctx
+      ))
+
+    if type(list_.storage) is array:
+      return RTResult().success(List(array(list_.storage.typecode, sorted(list_.numbers()))))
+
+    elements = list_.values()
+    if list_.numbers() is None and not all(isinstance(element, String) for element in elements):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "List must only contain numbers or only strings",
+        exec_ctx
+      ))
+
+    return RTResult().success(List(sorted(elements, key=lambda element: element.value)))
+  execute_sort.arg_names = ["list"]
+
+  def execute_memoize(self, exec_ctx):
+    function = exec_ctx.symbol_table.get("function")
+
+    if not isinstance(function, (Function, MemoizedFunction)):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "Argument must be function",
+        exec_ctx
+      ))
+
+    if isinstance(function, MemoizedFunction):
+      return RTResult().success(function)
+    return RTResult().success(MemoizedFunction(function))
+  execute_memoize.arg_names = ["function"]
+
+  def execute_memo_stats(self, exec_ctx):
+    function = exec_ctx.symbol_table.get("function")
+
+    if not isinstance(function, MemoizedFunction):
+      return RTResult().failure(RTError(
+        self.pos_start, self.pos_end,
+        "Argument must be memoized function",
+        exec_ctx
+      ))
+
+    return RTResult().success(String(function.stats()))
+  execute_memo_stats.arg_names = ["function"]
+
   def execute_run(self, exec_ctx):
     fn = exec_ctx.symbol_table.get("fn")
 
@@ -2473,7 +3742,18 @@ BuiltInFunction.print       = BuiltInFunction("print")
 BuiltInFunction.print_ret   = BuiltInFunction("print_ret")
 BuiltInFunction.input       = BuiltInFunction("input")
 BuiltInFunction.input_int   = BuiltInFunction("input_int")
+BuiltInFunction.read_all    = BuiltInFunction("read_all")
+BuiltInFunction.read_lines  = BuiltInFunction("read_lines")
+BuiltInFunction.read_line   = BuiltInFunction("read_line")
+BuiltInFunction.read_ints   = BuiltInFunction("read_ints")
+BuiltInFunction.open        = BuiltInFunction("open")
+BuiltInFunction.read        = BuiltInFunction("read")
+BuiltInFunction.readline    = BuiltInFunction("readline")
+BuiltInFunction.readlines   = BuiltInFunction("readlines")
+BuiltInFunction.write       = BuiltInFunction("write")
+BuiltInFunction.close       = BuiltInFunction("close")
 BuiltInFunction.clear       = BuiltInFunction("clear")
+BuiltInFunction.flush       = BuiltInFunction("flush")
 BuiltInFunction.is_number   = BuiltInFunction("is_number")
 BuiltInFunction.is_string   = BuiltInFunction("is_string")
 BuiltInFunction.is_list     = BuiltInFunction("is_list")
@@ -2483,6 +3763,14 @@ BuiltInFunction.pop         = BuiltInFunction("pop")
 BuiltInFunction.extend      = BuiltInFunction("extend")
 BuiltInFunction.len					= BuiltInFunction("len")
 BuiltInFunction.run					= BuiltInFunction("run")
+BuiltInFunction.map         = BuiltInFunction("map")
+BuiltInFunction.filter      = BuiltInFunction("filter")
+BuiltInFunction.reduce      = BuiltInFunction("reduce")
+BuiltInFunction.sum         = BuiltInFunction("sum")
+BuiltInFunction.range       = BuiltInFunction("range")
+BuiltInFunction.sort        = BuiltInFunction("sort")
+BuiltInFunction.memoize     = BuiltInFunction("memoize")
+BuiltInFunction.memo_stats  = BuiltInFunction("memo_stats")
 
 class Context:
   def __init__(self, display_name, parent=None, parent_entry_pos=None):
@@ -2490,6 +3778,8 @@ class Context:
     self.parent = parent
     self.parent_entry_pos = parent_entry_pos
     self.symbol_table = None
+    # the values of the loop invariants of top level code, see LoopHoister
+    self.invariants = None
 
 class SymbolTable:
   def __init__(self, parent=None):
@@ -2497,10 +3787,15 @@ class SymbolTable:
     self.parent = parent
 
   def get(self, name):
-    value = self.symbols.get(name, None)
-    if value == None and self.parent:
-      return self.parent.get(name)
-    return value
+    table = self
+    while table:
+      value = table.lookup(name)
+      if value is not None: return value
+      table = table.parent
+    return None
+
+  def lookup(self, name):
+    return self.symbols.get(name, None)
 
   def set(self, name, value):
     self.symbols[name] = value
@@ -2508,6 +3803,48 @@ class SymbolTable:
   def remove(self, name):
     del self.symbols[name]
 
+class FrameSymbolTable(SymbolTable):
+  def __init__(self, frame_layout, parent=None):
+    self.frame_layout = frame_layout
+    self.slots = [None] * len(frame_layout)
+    # names the Resolver did not see, only created when one is set
+    self.symbols = None
+    self.parent = parent
+
+  def lookup(self, name):
+    slot = self.frame_layout.get(name)
+    if slot is not None:
+      return self.slots[slot]
+    if self.symbols:
+      return self.symbols.get(name, None)
+    return None
+
+  def get_slot(self, slot, name):
+    value = self.slots[slot]
+    if value is None and self.parent:
+      return self.parent.get(name)
+    return value
+
+  def get_parent(self, name):
+    if self.parent:
+      return self.parent.get(name)
+    return None
+
+  def set(self, name, value):
+    slot = self.frame_layout.get(name)
+    if slot is not None:
+      self.slots[slot] = value
+    else:
+      if self.symbols is None: self.symbols = {}
+      self.symbols[name] = value
+
+  def remove(self, name):
+    slot = self.frame_layout.get(name)
+    if slot is not None:
+      self.slots[slot] = None
+    else:
+      del self.symbols[name]
+
 
 global_symbol_table = SymbolTable()
 global_symbol_table.set("null", Number.null)
@@ -2518,7 +3855,18 @@ global_symbol_table.set("printh", BuiltInFunction.print)
 global_symbol_table.set("printh_ret", BuiltInFunction.print_ret)
 global_symbol_table.set("input", BuiltInFunction.input)
 global_symbol_table.set("input_int", BuiltInFunction.input_int)
+global_symbol_table.set("read_all", BuiltInFunction.read_all)
+global_symbol_table.set("read_lines", BuiltInFunction.read_lines)
+global_symbol_table.set("read_line", BuiltInFunction.read_line)
+global_symbol_table.set("read_ints", BuiltInFunction.read_ints)
+global_symbol_table.set("open", BuiltInFunction.open)
+global_symbol_table.set("read", BuiltInFunction.read)
+global_symbol_table.set("readline", BuiltInFunction.readline)
+global_symbol_table.set("readlines", BuiltInFunction.readlines)
+global_symbol_table.set("write", BuiltInFunction.write)
+global_symbol_table.set("close", BuiltInFunction.close)
 global_symbol_table.set("clear", BuiltInFunction.clear)
+global_symbol_table.set("flush", BuiltInFunction.flush)
 global_symbol_table.set("cls", BuiltInFunction.clear)
 global_symbol_table.set("is_number", BuiltInFunction.is_number)
 global_symbol_table.set("is_string", BuiltInFunction.is_string)
@@ -2529,6 +3877,14 @@ global_symbol_table.set("pop", BuiltInFunction.pop)
 global_symbol_table.set("entend", BuiltInFunction.extend)
 global_symbol_table.set("len", BuiltInFunction.len)
 global_symbol_table.set("run", BuiltInFunction.run)
+global_symbol_table.set("map", BuiltInFunction.map)
+global_symbol_table.set("filter", BuiltInFunction.filter)
+global_symbol_table.set("reduce", BuiltInFunction.reduce)
+global_symbol_table.set("sum", BuiltInFunction.sum)
+global_symbol_table.set("range", BuiltInFunction.range)
+global_symbol_table.set("sort", BuiltInFunction.sort)
+global_symbol_table.set("memoize", BuiltInFunction.memoize)
+global_symbol_table.set("memo_stats", BuiltInFunction.memo_stats)
 
 def cmd_echoed(cmd):
     print("[CMD] %s" % " ".join(map(shlex.quote, cmd)))
@@ -2859,12 +4215,18 @@ class CompileCode:
     tokens.append("PRINTH")
 
   def evalExpr(self, expr):
-    # I know what I am doing wrong here
-    # the eval function is not safe to use
-    # but before you can input malicious code, the lexer will give you a error
-    # I will make my own evalExpr function later 
-    # this is cheating a little as this is a python's built in function and not a assembly code of doing this but for now this works fine
-    return str(eval(expr))
+    # the expression is parsed and folded into a single number by the same Optimizer the
+    # interpreter uses instead of handing it to python's eval
+    tokens, error = Lexer('<expr>', expr).make_tokens()
+    if error: raise Exception(error.as_string())
+
+    ast = Parser(tokens).parse()
+    if ast.error: raise Exception(ast.error.as_string())
+
+    node = Optimizer().optimize(ast.node.element_nodes[0])
+    if not isinstance(node, NumberNode):
+      raise Exception("ERROR: can not evaluate expression " + expr)
+    return str(node.tok.value)
 
   def endswith1(self, hustle_ext, basepath):
     if basepath.endswith(hustle_ext):
@@ -2892,30 +4254,467 @@ def com_run(fn, text, data):
   if error:
     print(error)
 
-def run(fn, text):
+# the execution engine used by run(), `hustle.py run --engine=<engine>` changes it
+ENGINES = ['tree', 'closure', 'vm']
+engine = 'tree'
+
+# parsed and resolved programs are pickled into a cache directory of the user running them
+# ($XDG_CACHE_HOME/hustle or ~/.cache/hustle), `hustle.py run --no-cache` turns it off. an
+# entry is only used when it was made from the same file name and text by the same
+# interpreter. unpickling runs code, so the cache is never kept next to the sources (where
+# anyone who can write a script could plant an entry), is not read from a directory someone
+# else could write to, and an entry is only unpickled after its header matched byte for byte
+CACHE_MAGIC = b'HUSTLEAST\0'
+use_cache = True
+
+# printh writes to sys.stdout like every other message of the interpreter, so they always
+# come out in order. `hustle.py run` makes it block buffered with a buffer of
+# output_buffer_size bytes (`--buffer-size=<bytes>`), since a write for every line is what
+# bounds programs that print a lot, and `--unbuffered` writes every line as it is printed.
+# anything that hands the terminal to something else (input, Exit, system, sleep, clear)
+# flushes it first, and so does the flush() builtin
+OUTPUT_BUFFER_SIZE = 1 << 16
+output_buffer_size = OUTPUT_BUFFER_SIZE
+
+def buffer_output(size):
+  stdout = sys.stdout
+  if size == 0:
+    stdout.reconfigure(line_buffering=True)
+    return
+
+  try:
+    fd = stdout.fileno()
+  except (AttributeError, ValueError, OSError):
+    return
+  stdout.flush()
+  sys.stdout = open(fd, 'w', buffering=size, encoding=stdout.encoding, errors=stdout.errors, closefd=False)
+
+def flush_output():
+  sys.stdout.flush()
+
+# the cached trees hold objects and token types of this module, ops.ops and keywords.keywords,
+# so a change to any of them makes every entry stale
+def interpreter_version():
+  version = hashlib.sha256(sys.version.encode())
+  for module_name in (__name__, 'ops.ops', 'keywords.keywords'):
+    with open(sys.modules[module_name].__file__, 'rb') as f:
+      version.update(f.read())
+  return version.hexdigest()
+
+INTERPRETER_VERSION = interpreter_version()
+
+# pickle recurses on the C stack for every level of the tree, so it runs with a recursion
+# limit of its own and programs nested deeper than that are just not cached
+PICKLE_RECURSION_LIMIT = 10000
+
+def cache_dir():
+  return path.join(os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache'), 'hustle')
+
+def cache_path(fn):
+  name = hashlib.sha256(path.abspath(fn).encode('utf-8', 'surrogatepass')).hexdigest()
+  return path.join(cache_dir(), name + '.ast')
+
+def cache_header(fn, text):
+  return CACHE_MAGIC + hashlib.sha256(f'{INTERPRETER_VERSION}\0{fn}\0{text}'.encode('utf-8', 'surrogatepass')).digest()
+
+# only the user running the interpreter may be able to write the cache directory
+def is_private_dir(dir_path):
+  info = os.stat(dir_path)
+  return info.st_uid == os.getuid() and info.st_mode & 0o022 == 0
+
+def with_pickle_recursion_limit(function, *args):
+  depth = 0
+  frame = sys._getframe()
+  while frame:
+    depth += 1
+    frame = frame.f_back
+
+  # the tree has no reference cycles, so the collector is paused like it is while lexing
+  recursion_limit = sys.getrecursionlimit()
+  gc_enabled = gc.isenabled()
+  sys.setrecursionlimit(depth + PICKLE_RECURSION_LIMIT)
+  gc.disable()
+  try:
+    return function(*args)
+  finally:
+    sys.setrecursionlimit(recursion_limit)
+    if gc_enabled: gc.enable()
+
+def load_cached_ast(fn, text):
+  def load():
+    if not is_private_dir(cache_dir()): return None
+    header = cache_header(fn, text)
+    with open(cache_path(fn), 'rb') as f:
+      if f.read(len(header)) != header: return None
+      return pickle.load(f)
+
+  try:
+    return with_pickle_recursion_limit(load)
+  except Exception:
+    return None
+
+def store_cached_ast(fn, text, node):
+  def store():
+    os.makedirs(cache_dir(), mode=0o700, exist_ok=True)
+    if not is_private_dir(cache_dir()): return
+    tmp_path = f'{cache_path(fn)}.{os.getpid()}.tmp'
+    try:
+      with open(tmp_path, 'wb') as f:
+        f.write(cache_header(fn, text))
+        pickle.dump(node, f, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, cache_path(fn))
+    finally:
+      if path.exists(tmp_path): os.remove(tmp_path)
+
+  # a cache that can't be written (read only directory, too deep a tree) is not an error
+  try:
+    with_pickle_recursion_limit(store)
+  except Exception:
+    pass
+
+def parse_program(fn, text):
+  cacheable = use_cache and path.isfile(fn)
+  if cacheable:
+    node = load_cached_ast(fn, text)
+    if node: return node, None
+
   lexer = Lexer(fn, text)
-  tokens, error = lexer.make_tokens()
-  if error: return None, error
+  tokens = lexer.iter_tokens()
 
   parser = Parser(tokens)
   ast = parser.parse()
+  # an illegal character anywhere in the file is reported before any syntax error
+  if ast.error:
+    for tok in tokens: pass
+  if lexer.error: return None, lexer.error
   if ast.error: return None, ast.error
 
-  interpreter = Interpreter()
+  node = Optimizer().optimize(ast.node)
+  Resolver().resolve(node)
+  LoopHoister().hoist(node)
+
+  if cacheable: store_cached_ast(fn, text, node)
+  return node, None
+
+def run(fn, text):
+  node, error = parse_program(fn, text)
+  if error: return None, error
+
   context = Context('<program>')
   context.symbol_table = global_symbol_table
-  result = interpreter.visit(ast.node, context)
+
+  if engine == 'closure':
+    result = Compiler().run(node, context)
+  elif engine == 'vm':
+    result = VM().run(BytecodeCompiler().compile_program(node), context)
+  else:
+    interpreter = Interpreter()
+    result = interpreter.visit(node, context)
 
   return result.value, result.error
 
-class Interpreter:
-  def visit(self, node, context):
-    method_name = f'visit_{type(node).__name__}'
-    method = getattr(self, method_name, self.no_visit_method)
-    return method(node, context)
+# intrinsics are shared by every execution engine, they get the already evaluated
+# operands of their node and return the resulting value
+
+def intrinsic_argv(node, context, argv_count):
+  argvs = []
+  # I think this is how argv work in python
+  # ./hustle argv0 argv1 argv2 argv3 argv4 .....
+
+  # Context:-
+  # ./hustle  run   file  
+
+  def main():
+  # I am adding 2 because the code runner uses 2 args to interpret a file
+  # 1 is run subcommand
+  # other is the file itself
+  # so following my concept of how argvs work in python 
+  # I added 2 args from 0 to subtract the offset 
+    rs = sys.argv[int(str(int(str(argv_count)) + 2))] 
+    argvs.append(rs)
+
+  main()
+  return (
+    Number.null if node.should_return_null else
+    List(argvs).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
 
-  def no_visit_method(self, node, context):
-    raise Exception(f'No visit_{type(node).__name__} method defined')
+def intrinsic_exit(node, context, exit_code):
+  exits = []
+  flush_output()
+
+  def main():
+    try:
+      try:
+        if isinstance(int(str(exit_code)), int): 
+          exit(int(str(exit_code)))
+        else: 
+          exit()
+      except Exception as e: 
+        if isinstance(str(exit_code), str): 
+          exit(str(exit_code))
+    except Exception as e: 
+      print("Runtime Error: " + str(e))
+  main()
+  return (
+    Number.null if node.should_return_null else
+    List(exits).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_make_float(node, context, float_name):
+  flootes = float(str(float_name))
+
+  return (
+    Number.null if node.should_return_null else
+    Number(flootes).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_make_int(node, context, int_name):
+  ant = int(str(int_name))
+
+  return (
+    Number.null if node.should_return_null else
+    Number(ant).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_make_str(node, context, str_name):
+  strang = str(str_name)
+
+  return (
+    Number.null if node.should_return_null else
+    String(strang).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+# a module is only run by the first include() of it in this process, later includes of the
+# same file put the globals it defined back instead of reading, parsing and running it again
+loaded_modules = {}
+
+def intrinsic_include(node, context, include_var):
+  modules = {
+    "@" : "stdlib.hsle"
+  }
+
+  def open_file(filename):
+    if filename.endswith('.hsle'):
+      data = filename
+      return data
+    else:
+      print("file does not have .hsle extension")
+      exit(1)
+
+  if str(include_var) == "all":
+    data = open_file(modules["@"])
+  elif str(include_var) == "stdlib":
+    data = open_file(modules["@"])
+  else: 
+    try: 
+      data = open_file(str(include_var)) 
+    except:
+      print("RUNTIME ERROR: could not find module")
+      print("please give relative path or the full path to the module")
+      sys.exit("File Not Found: " + str(include_var))
+      
+  module_path = path.abspath(data)
+
+  if module_path in loaded_modules:
+    global_symbol_table.symbols.update(loaded_modules[module_path])
+    print(repr(Number.null))
+  else:
+    symbols_before = dict(global_symbol_table.symbols)
+
+    text = "run(\""+data+"\")"
+    result, error = run('<stdin>',text)
+
+    if error:
+      print(error.as_string())
+    else:
+      loaded_modules[module_path] = {
+        name: value for name, value in global_symbol_table.symbols.items()
+        if symbols_before.get(name) is not value
+      }
+      if result:
+        if result.length == 1:
+          print(repr(result.get(0)))
+        else:
+          print(repr(result))
+        
+  return (
+    Number.null if node.should_return_null else
+    List(modules).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_sleep(node, context, sleep_value):
+  times = []
+  flush_output()
+
+  if float(str(sleep_value)) <= 0:
+    print("RUNTIME ERROR: sleep value is negative or null")
+    print("time cannot sleep for " + sleep_value + " seconds")
+    sys.exit("Syntax Error: Incorrect Syntax " + str(sleep_value))
+  else:
+    time.sleep(float(str(sleep_value)))
+
+  return (
+    Number.null if node.should_return_null else
+    List(times).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )      
+
+def intrinsic_system(node, context, command_value):
+  commands = []
+  flush_output()
+
+  def crun():
+    try:
+      os.system(str(command_value))
+    except: 
+      print("Syntax Error: Invalid command in system keyword")
+      sys.exit("Invalid Command: " + command_value)
+    
+  crun()
+  
+  return (
+    Number.null if node.should_return_null else
+    List(commands).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_shuffle(node, context, shuffle_value):
+  # TODO: implement a shuffle function that shuffles a list
+  if isinstance(shuffle_value, List):
+    shuffle_value.shuffle()
+    list_name = shuffle_value.values()
+  else:
+    print("RUNTIME ERROR: shuffle value is not a list")
+    print("make sure the value is a list")
+    sys.exit("Syntax Error: Incorrect Syntax " + str(shuffle_value))
+
+  return (
+    Number.null if node.should_return_null else
+    # convert this back to List() when you implemented the shuffle function
+    List(list_name).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )    
+
+def intrinsic_len_str(node, context, str_tok):
+  try:
+    length = len(str(str_tok))
+  except Exception as e:
+    print("RUNTIME ERROR: " + e)
+    sys.exit("RUNTIME Error: could not take the length of the string " + str(str_tok))
+
+  return (
+    Number.null if node.should_return_null else
+    Number(length).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_take_element(node, context, list_name, index):
+  lses = []
+
+  # github copilot helped me out on this one lul
+  def take_element(list_name, index):
+    if isinstance(list_name, List):
+      if isinstance(index, Number):
+        if index.value < list_name.length:
+          return list_name.get(index.value)
+        else:
+          print("RUNTIME ERROR: index out of range")
+          sys.exit("Index Out of Range: " + str(index.value))
+      else:
+        print("RUNTIME ERROR: index is not a number")
+        sys.exit("Index is not a number: " + str(index))
+    # check if the list is a string
+    elif isinstance(list_name, String):
+      if isinstance(index, Number):
+        if index.value < len(list_name.value):
+          return String(list_name.value[index.value])
+        else:
+          print("RUNTIME ERROR: index out of range")
+          sys.exit("Index Out of Range: " + str(index.value))
+      else:
+        print("RUNTIME ERROR: index is not a number")
+        sys.exit("Index is not a number: " + str(index))
+    else:
+      print("RUNTIME ERROR: list is not a list or string")
+      sys.exit("List is not a list or string: " + str(list_name))
+  lses.append(take_element(list_name, index))
+
+  try:
+    take_element(list_name, index)
+  except Exception as e:
+    print("RUNTIME ERROR: " + str(e))
+
+  return (
+    Number.null if node.should_return_null else
+    List(lses).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+def intrinsic_rand_int(node, context, min_value, max_value):
+  try:
+    num = random.randint(int(str(min_value)), int(str(max_value)))   
+  except:
+    print(" : getting random numbers failed : ")
+    sys.exit(1)
+
+  return (
+    Number.null if node.should_return_null else
+    Number(num).set_context(context).set_pos(node.pos_start, node.pos_end)
+  )
+
+BINARY_OPERATIONS = {
+  TT_PLUS : 'added_to',
+  TT_MINUS: 'subbed_by',
+  TT_MUL  : 'multed_by',
+  TT_MOD  : 'moded_by',
+  TT_DIV  : 'dived_by',
+  TT_POW  : 'powed_by',
+  TT_EE   : 'get_comparison_eq',
+  TT_NE   : 'get_comparison_ne',
+  TT_LT   : 'get_comparison_lt',
+  TT_GT   : 'get_comparison_gt',
+  TT_LTE  : 'get_comparison_lte',
+  TT_GTE  : 'get_comparison_gte',
+  'and'   : 'anded_by',
+  'or'    : 'ored_by'
+}
+
+def binary_operation(op_tok):
+  if op_tok.type == TT_KEYWORD:
+    return BINARY_OPERATIONS[op_tok.value]
+  return BINARY_OPERATIONS[op_tok.type]
+
+# values are shared between variables and never carry the position of the expression
+# that produced them, an operation that failed is run again on copies placed at the
+# operand nodes so the error points at the right place
+def operation_error(method_name, left, right, node, context):
+  left = left.copy().set_pos(node.left_node.pos_start, node.left_node.pos_end).set_context(context)
+  right = right.copy().set_pos(node.right_node.pos_start, node.right_node.pos_end).set_context(context)
+  return getattr(left, method_name)(right)[1]
+
+def unary_operation_error(node, number, context):
+  number = number.copy().set_pos(node.node.pos_start, node.node.pos_end).set_context(context)
+  if node.op_tok.type == TT_MINUS:
+    return number.multed_by(Number(-1))[1]
+  return number.notted()[1]
+
+
+# the values the variable of a for loop takes. a loop over integers is a python range,
+# anything else (floats, a step of 0) is counted by hand like the loop always was
+def for_counter(start, end, step):
+  if type(start) is int and type(end) is int and type(step) is int and step != 0:
+    return range(start, end, step)
+  return uncounted_for(start, end, step)
+
+def uncounted_for(i, end, step):
+  while (i < end) if step >= 0 else (i > end):
+    yield i
+    i += step
+
+class Interpreter:
+  def visit(self, node, context):
+    method_name = f'visit_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_visit_method)
+    return method(node, context)
+
+  def no_visit_method(self, node, context):
+    raise Exception(f'No visit_{type(node).__name__} method defined')
 
 
   def visit_NumberNode(self, node, context):
@@ -2924,9 +4723,7 @@ class Interpreter:
     )
 
   def visit_StringNode(self, node, context):
-    return RTResult().success(
-      String(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-  )
+    return RTResult().success(node.value)
 
   def visit_ListNode(self, node, context):
     res = RTResult()
@@ -2943,7 +4740,13 @@ class Interpreter:
   def visit_VarAccessNode(self, node, context):
     res = RTResult()
     var_name = node.var_name_tok.value
-    value = context.symbol_table.get(var_name)
+
+    if node.depth == 0:
+      value = context.symbol_table.get_slot(node.slot, var_name)
+    elif node.depth == 1:
+      value = context.symbol_table.get_parent(var_name)
+    else:
+      value = context.symbol_table.get(var_name)
 
     if not value:
       return res.failure(RTError(
@@ -2952,7 +4755,6 @@ class Interpreter:
         context
       ))
 
-    value = value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
     return res.success(value)
 
   def visit_VarAssignNode(self, node, context):
@@ -2961,7 +4763,10 @@ class Interpreter:
     value = res.register(self.visit(node.value_node, context))
     if res.should_return(): return res
 
-    context.symbol_table.set(var_name, value)
+    if node.slot is not None:
+      context.symbol_table.slots[node.slot] = value
+    else:
+      context.symbol_table.set(var_name, value)
     return res.success(value)
 
   def visit_BinOpNode(self, node, context):
@@ -2971,56 +4776,35 @@ class Interpreter:
     right = res.register(self.visit(node.right_node, context))
     if res.should_return(): return res
 
-    if node.op_tok.type == TT_PLUS:
-      result, error = left.added_to(right)
-    elif node.op_tok.type == TT_MINUS:
-      result, error = left.subbed_by(right)
-    elif node.op_tok.type == TT_MUL:
-      result, error = left.multed_by(right)
-    elif node.op_tok.type == TT_MOD:
-      result, error = left.moded_by(right)
-    elif node.op_tok.type == TT_DIV:
-      result, error = left.dived_by(right)
-    elif node.op_tok.type == TT_POW:
-      result, error = left.powed_by(right)
-    elif node.op_tok.type == TT_EE:
-      result, error = left.get_comparison_eq(right)
-    elif node.op_tok.type == TT_NE:
-      result, error = left.get_comparison_ne(right)
-    elif node.op_tok.type == TT_LT:
-      result, error = left.get_comparison_lt(right)
-    elif node.op_tok.type == TT_GT:
-      result, error = left.get_comparison_gt(right)
-    elif node.op_tok.type == TT_LTE:
-      result, error = left.get_comparison_lte(right)
-    elif node.op_tok.type == TT_GTE:
-      result, error = left.get_comparison_gte(right)
-    elif node.op_tok.matches(TT_KEYWORD, 'and'):
-      result, error = left.anded_by(right)
-    elif node.op_tok.matches(TT_KEYWORD, 'or'):
-      result, error = left.ored_by(right)
+    method_name = binary_operation(node.op_tok)
+
+    if type(left) is Number and type(right) is Number:
+      result = NUMBER_OPERATIONS[method_name](left.value, right.value)
+      if result is not None: return res.success(result)
+
+    result, error = getattr(left, method_name)(right)
 
     if error:
-      return res.failure(error)
+      return res.failure(operation_error(method_name, left, right, node, context))
     else:
-      return res.success(result.set_pos(node.pos_start, node.pos_end))
+      return res.success(result)
 
   def visit_UnaryOpNode(self, node, context):
     res = RTResult()
     number = res.register(self.visit(node.node, context))
     if res.should_return(): return res
 
-    error = None
+    result, error = number, None
 
     if node.op_tok.type == TT_MINUS:
-      number, error = number.multed_by(Number(-1))
+      result, error = number.multed_by(Number(-1))
     elif node.op_tok.matches(TT_KEYWORD, 'not'):
-      number, error = number.notted()
+      result, error = number.notted()
 
     if error:
-      return res.failure(error)
+      return res.failure(unary_operation_error(node, number, context))
     else:
-      return res.success(number.set_pos(node.pos_start, node.pos_end))
+      return res.success(result)
 
   def visit_IfNode(self, node, context):
     res = RTResult()
@@ -3044,218 +4828,66 @@ class Interpreter:
 
   def visit_ArgvNode(self, node, context):
     res = RTResult()
-    argvs = []
-
     argv_count = res.register(self.visit(node.argv_count, context))
     if res.should_return(): return res
-   
-    # I think this is how argv work in python
-    # ./hustle argv0 argv1 argv2 argv3 argv4 .....
-
-    # Context:-
-    # ./hustle  run   file  
-
-    def main():
-    # I am adding 2 because the code runner uses 2 args to interpret a file
-    # 1 is run subcommand
-    # other is the file itself
-    # so following my concept of how argvs work in python 
-    # I added 2 args from 0 to subtract the offset 
-      rs = sys.argv[int(str(int(str(argv_count)) + 2))] 
-      argvs.append(rs)
-
-    main()
-    return res.success(
-      Number.null if node.should_return_null else
-      List(argvs).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_argv(node, context, argv_count))
 
   def visit_ExitNode(self, node, context):
     res = RTResult()
-    exits = []
-
     exit_code = res.register(self.visit(node.exit_code, context))
     if res.should_return(): return res
-
-    def main():
-      try:
-        try:
-          if isinstance(int(str(exit_code)), int): 
-            exit(int(str(exit_code)))
-          else: 
-            exit()
-        except Exception as e: 
-          if isinstance(str(exit_code), str): 
-            exit(str(exit_code))
-      except Exception as e: 
-        print("Runtime Error: " + str(e))
-    main()
-    return res.success(
-      Number.null if node.should_return_null else
-      List(exits).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )    
+    return res.success(intrinsic_exit(node, context, exit_code))
 
   def visit_MakeFloatNode(self, node, context):
     res = RTResult()
     float_name = res.register(self.visit(node.float_tok, context))
     if res.should_return(): return res
-
-    flootes = float(str(float_name))
-
-    return res.success(
-      Number.null if node.should_return_null else
-      Number(flootes).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )    
+    return res.success(intrinsic_make_float(node, context, float_name))
 
   def visit_MakeIntNode(self, node, context):
     res = RTResult()
     int_name = res.register(self.visit(node.int_tok, context))
     if res.should_return(): return res
-
-    ant = int(str(int_name))
-
-    return res.success(
-      Number.null if node.should_return_null else
-      Number(ant).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )    
+    return res.success(intrinsic_make_int(node, context, int_name))
 
   def visit_MakeStrNode(self, node, context):
     res = RTResult()
     str_name = res.register(self.visit(node.string_tok, context))
     if res.should_return(): return res
-
-    strang = str(str_name)
-
-    return res.success(
-      Number.null if node.should_return_null else
-      String(strang).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_make_str(node, context, str_name))
 
   def visit_IncludeNode(self, node, context):
     res = RTResult()
-    modules = {
-      "@" : "stdlib.hsle"
-    }
     include_var = res.register(self.visit(node.include_name, context))
     if res.should_return(): return res    
-    
-    def open_file(filename):
-      if filename.endswith('.hsle'):
-        data = filename
-        return data
-      else:
-        print("file does not have .hsle extension")
-        exit(1)
-
-    if str(include_var) == "all":
-      data = open_file(modules["@"])
-    elif str(include_var) == "stdlib":
-      data = open_file(modules["@"])
-    else: 
-      try: 
-        data = open_file(str(include_var)) 
-      except:
-        print("RUNTIME ERROR: could not find module")
-        print("please give relative path or the full path to the module")
-        sys.exit("File Not Found: " + str(include_var))
-        
-    text = "run(\""+data+"\")"
-    result, error = run('<stdin>',text)
-
-    if error:
-      print(error.as_string())
-    elif result:
-      if len(result.elements) == 1:
-        print(repr(result.elements[0]))
-      else:
-        print(repr(result))
-          
-    return res.success(
-      Number.null if node.should_return_null else
-      List(modules).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_include(node, context, include_var))
 
   def visit_SleepNode(self, node, context): 
     res = RTResult()
-    times = []
-
     sleep_value = res.register(self.visit(node.time_name, context))
     if res.should_return(): return res   
-
-    if float(str(sleep_value)) <= 0:
-      print("RUNTIME ERROR: sleep value is negative or null")
-      print("time cannot sleep for " + sleep_value + " seconds")
-      sys.exit("Syntax Error: Incorrect Syntax " + str(sleep_value))
-    else:
-      time.sleep(float(str(sleep_value)))
-
-    return res.success(
-      Number.null if node.should_return_null else
-      List(times).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )      
+    return res.success(intrinsic_sleep(node, context, sleep_value))
 
   def visit_SystemNode(self, node, context):
     res = RTResult()
-    commands = []
-
     command_value = res.register(self.visit(node.system_command_name, context))
     if res.should_return(): return res   
-
-    def crun():
-      try:
-        os.system(str(command_value))
-      except: 
-        print("Syntax Error: Invalid command in system keyword")
-        sys.exit("Invalid Command: " + command_value)
-      
-    crun()
-    
-    return res.success(
-      Number.null if node.should_return_null else
-      List(commands).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_system(node, context, command_value))
 
   def visit_ShuffleNode(self, node, context):
     res = RTResult()
-
     shuffle_value = res.register(self.visit(node.list_name, context))
     if res.should_return(): return res
-
-    # TODO: implement a shuffle function that shuffles a list
-    if isinstance(shuffle_value, List):
-      list_name = shuffle_value.elements
-      random.shuffle(list_name)
-    else:
-      print("RUNTIME ERROR: shuffle value is not a list")
-      print("make sure the value is a list")
-      sys.exit("Syntax Error: Incorrect Syntax " + str(shuffle_value))
-
-    return res.success(
-      Number.null if node.should_return_null else
-      # convert this back to List() when you implemented the shuffle function
-      List(list_name).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )    
+    return res.success(intrinsic_shuffle(node, context, shuffle_value))
 
   def visit_lenStrNode(self, node, context):
     res = RTResult()
-
     str_tok = res.register(self.visit(node.string_tok, context))
     if res.should_return(): return res
-
-    try:
-      length = len(str(str_tok))
-    except Exception as e:
-      print("RUNTIME ERROR: " + e)
-      sys.exit("RUNTIME Error: could not take the length of the string " + str(str_tok))
-
-    return res.success(
-      Number.null if node.should_return_null else
-      Number(length).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_len_str(node, context, str_tok))
 
   def visit_takeElementNode(self, node, context):
     res = RTResult()
-    lses = []
 
     list_name = res.register(self.visit(node.list_name, context))
     if res.should_return(): return res 
@@ -3263,47 +4895,10 @@ class Interpreter:
     index = res.register(self.visit(node.index_name, context))
     if res.should_return(): return res
 
-    # github copilot helped me out on this one lul
-    def take_element(list_name, index):
-      if isinstance(list_name, List):
-        if isinstance(index, Number):
-          if index.value < len(list_name.elements):
-            return list_name.elements[index.value]
-          else:
-            print("RUNTIME ERROR: index out of range")
-            sys.exit("Index Out of Range: " + str(index.value))
-        else:
-          print("RUNTIME ERROR: index is not a number")
-          sys.exit("Index is not a number: " + str(index))
-      # check if the list is a string
-      elif isinstance(list_name, String):
-        if isinstance(index, Number):
-          if index.value < len(list_name.value):
-            return String(list_name.value[index.value])
-          else:
-            print("RUNTIME ERROR: index out of range")
-            sys.exit("Index Out of Range: " + str(index.value))
-        else:
-          print("RUNTIME ERROR: index is not a number")
-          sys.exit("Index is not a number: " + str(index))
-      else:
-        print("RUNTIME ERROR: list is not a list or string")
-        sys.exit("List is not a list or string: " + str(list_name))
-    lses.append(take_element(list_name, index))
-
-    try:
-      take_element(list_name, index)
-    except Exception as e:
-      print("RUNTIME ERROR: " + str(e))
-
-    return res.success(
-      Number.null if node.should_return_null else
-      List(lses).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_take_element(node, context, list_name, index))
 
   def visit_randIntNode(self, node, context):
     res = RTResult()
-    rands = []
 
     min_value = res.register(self.visit(node.first_rand_name, context))
     if res.should_return(): return res 
@@ -3311,16 +4906,7 @@ class Interpreter:
     max_value = res.register(self.visit(node.second_rand_name, context))
     if res.should_return(): return res
 
-    try:
-      num = random.randint(int(str(min_value)), int(str(max_value)))   
-    except:
-      print(" : getting random numbers failed : ")
-      sys.exit(1)
-
-    return res.success(
-      Number.null if node.should_return_null else
-      Number(num).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return res.success(intrinsic_rand_int(node, context, min_value, max_value))
 
   def visit_ForNode(self, node, context):
     res = RTResult()
@@ -3338,28 +4924,29 @@ class Interpreter:
     else:
       step_value = Number(1)
 
-    i = start_value.value
-  
+    if node.invariants: reset_invariants(node.invariants, context)
 
-    if step_value.value >= 0:
-      condition = lambda: i < end_value.value
-    else:
-      condition = lambda: i > end_value.value
-    
-    while condition():
-      context.symbol_table.set(node.var_name_tok.value, Number(i))
-      i += step_value.value
+    symbol_table = context.symbol_table
+    slot = node.slot
+    var_name = node.var_name_tok.value
+    body_node = node.body_node
 
-      value = res.register(self.visit(node.body_node, context))
-      if res.should_return() and res.loop_should_continue == False and res.loop_should_break == False: return res
-      
-      if res.loop_should_continue:
-        continue
-      
-      if res.loop_should_break:
-        break
+    for i in for_counter(start_value.value, end_value.value, step_value.value):
+      if slot is not None:
+        symbol_table.slots[slot] = make_number(i)
+      else:
+        symbol_table.set(var_name, make_number(i))
+
+      body_res = self.visit(body_node, context)
+      if body_res.should_return():
+        if body_res.loop_should_continue: continue
+        if body_res.loop_should_break: break
+        return body_res
 
-      elements.append(value)
+      if not node.should_return_null:
+        elements.append(body_res.value)
+
+    if node.invariants: reset_invariants(node.invariants, context)
 
     return res.success(
       Number.null if node.should_return_null else
@@ -3370,6 +4957,8 @@ class Interpreter:
     res = RTResult()
     elements = []
 
+    if node.invariants: reset_invariants(node.invariants, context)
+
     while True:
       condition = res.register(self.visit(node.condition_node, context))
       if res.should_return(): return res
@@ -3386,7 +4975,10 @@ class Interpreter:
       if res.loop_should_break:
         break
 
-      elements.append(value)
+      if not node.should_return_null:
+        elements.append(value)
+
+    if node.invariants: reset_invariants(node.invariants, context)
 
     return res.success(
       Number.null if node.should_return_null else
@@ -3399,34 +4991,40 @@ class Interpreter:
     func_name = node.var_name_tok.value if node.var_name_tok else None
     body_node = node.body_node
     arg_names = [arg_name.value for arg_name in node.arg_name_toks]
-    func_value = Function(func_name, body_node, arg_names, node.should_auto_return).set_context(context).set_pos(node.pos_start, node.pos_end)
+    func_value = Function(func_name, body_node, arg_names, node.should_auto_return, node.frame_layout).set_context(context).set_pos(node.pos_start, node.pos_end)
     
-    if node.var_name_tok:
+    if node.slot is not None:
+      context.symbol_table.slots[node.slot] = func_value
+    elif node.var_name_tok:
       context.symbol_table.set(func_name, func_value)
 
     return res.success(func_value)
 
-  def visit_CallNode(self, node, context):
+  def visit_CallNode(self, node, context, tail_call_body=None):
     res = RTResult()
     args = []
 
     value_to_call = res.register(self.visit(node.node_to_call, context))
     if res.should_return(): return res
-    value_to_call = value_to_call.copy().set_pos(node.pos_start, node.pos_end)
 
     for arg_node in node.arg_nodes:
       args.append(res.register(self.visit(arg_node, context)))
       if res.should_return(): return res
 
-    return_value = res.register(value_to_call.execute(args))
+    if type(value_to_call) is Function and value_to_call.body_node is tail_call_body:
+      return res.success_return(TailCall(args, node.pos_start, node.pos_end))
+
+    return_value = res.register(value_to_call.call(args, context, node.pos_start, node.pos_end))
     if res.should_return(): return res
-    return_value = return_value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
     return res.success(return_value)
 
   def visit_ReturnNode(self, node, context):
     res = RTResult()
 
-    if node.node_to_return:
+    if node.tail_call_body is not None:
+      value = res.register(self.visit_CallNode(node.node_to_return, context, node.tail_call_body))
+      if res.should_return(): return res
+    elif node.node_to_return:
       value = res.register(self.visit(node.node_to_return, context))
       if res.should_return(): return res
     else:
@@ -3437,5 +5035,816 @@ class Interpreter:
   def visit_ContinueNode(self, node, context):
     return RTResult().success_continue()
 
+  def visit_InvariantNode(self, node, context):
+    res = RTResult()
+
+    value = invariant_value(node, context)
+    if value is not None: return res.success(value)
+
+    value = res.register(self.visit(node.node, context))
+    if res.should_return(): return res
+
+    keep_invariant(node, value, context)
+    return res.success(value)
+
   def visit_BreakNode(self, node, context):
     return RTResult().success_break()
+
+# Function bodies are run by this one, the Interpreter keeps no state of its own
+tree_interpreter = Interpreter()
+
+# closure compilation mode: the AST is walked only once and every node is turned into
+# a python function taking the context, so running the program is just direct calls
+class Compiler:
+  def run(self, node, context):
+    return run_code(self.compile(node), context)
+
+  def compile(self, node):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    return method(node)
+
+  def no_compile_method(self, node):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  def intrinsic(self, node, intrinsic_func, *operand_nodes):
+    operand_codes = [self.compile(operand_node) for operand_node in operand_nodes]
+
+    def code(context):
+      return intrinsic_func(node, context, *[operand_code(context) for operand_code in operand_codes])
+    return code
+
+
+  def compile_NumberNode(self, node):
+    value = node.tok.value
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    def code(context):
+      return Number(value).set_context(context).set_pos(pos_start, pos_end)
+    return code
+
+  def compile_StringNode(self, node):
+    value = node.value
+
+    def code(context):
+      return value
+    return code
+
+  def compile_ListNode(self, node):
+    element_codes = [self.compile(element_node) for element_node in node.element_nodes]
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    def code(context):
+      elements = [element_code(context) for element_code in element_codes]
+      return List(elements).set_context(context).set_pos(pos_start, pos_end)
+    return code
+
+  def compile_VarAccessNode(self, node):
+    var_name = node.var_name_tok.value
+    slot = node.slot
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    if node.depth == 0:
+      def lookup(context):
+        return context.symbol_table.get_slot(slot, var_name)
+    elif node.depth == 1:
+      def lookup(context):
+        return context.symbol_table.get_parent(var_name)
+    else:
+      def lookup(context):
+        return context.symbol_table.get(var_name)
+
+    def code(context):
+      value = lookup(context)
+
+      if not value:
+        raise RTFailure(RTError(
+          pos_start, pos_end,
+          f"'{var_name}' is not defined",
+          context
+        ))
+
+      return value
+    return code
+
+  def compile_VarAssignNode(self, node):
+    var_name = node.var_name_tok.value
+    slot = node.slot
+    value_code = self.compile(node.value_node)
+
+    if slot is not None:
+      def code(context):
+        value = value_code(context)
+        context.symbol_table.slots[slot] = value
+        return value
+    else:
+      def code(context):
+        value = value_code(context)
+        context.symbol_table.set(var_name, value)
+        return value
+    return code
+
+  def compile_BinOpNode(self, node):
+    left_code = self.compile(node.left_node)
+    right_code = self.compile(node.right_node)
+    method_name = binary_operation(node.op_tok)
+    number_operation = NUMBER_OPERATIONS[method_name]
+
+    def code(context):
+      left = left_code(context)
+      right = right_code(context)
+
+      if type(left) is Number and type(right) is Number:
+        result = number_operation(left.value, right.value)
+        if result is not None: return result
+
+      result, error = getattr(left, method_name)(right)
+      if error: raise RTFailure(operation_error(method_name, left, right, node, context))
+      return result
+    return code
+
+  def compile_UnaryOpNode(self, node):
+    number_code = self.compile(node.node)
+
+    if node.op_tok.type == TT_MINUS:
+      def operation(number):
+        return number.multed_by(Number(-1))
+    elif node.op_tok.matches(TT_KEYWORD, 'not'):
+      def operation(number):
+        return number.notted()
+    else:
+      def operation(number):
+        return number, None
+
+    def code(context):
+      number = number_code(context)
+      result, error = operation(number)
+      if error: raise RTFailure(unary_operation_error(node, number, context))
+      return result
+    return code
+
+  def compile_IfNode(self, node):
+    cases = [
+      (self.compile(condition), self.compile(expr), should_return_null)
+      for condition, expr, should_return_null in node.cases
+    ]
+    else_case = None
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      else_case = (self.compile(expr), should_return_null)
+
+    def code(context):
+      for condition_code, expr_code, should_return_null in cases:
+        if condition_code(context).is_true():
+          expr_value = expr_code(context)
+          return Number.null if should_return_null else expr_value
+
+      if else_case:
+        expr_code, should_return_null = else_case
+        expr_value = expr_code(context)
+        return Number.null if should_return_null else expr_value
+
+      return Number.null
+    return code
+
+  def compile_ArgvNode(self, node):
+    return self.intrinsic(node, intrinsic_argv, node.argv_count)
+
+  def compile_ExitNode(self, node):
+    return self.intrinsic(node, intrinsic_exit, node.exit_code)
+
+  def compile_MakeFloatNode(self, node):
+    return self.intrinsic(node, intrinsic_make_float, node.float_tok)
+
+  def compile_MakeIntNode(self, node):
+    return self.intrinsic(node, intrinsic_make_int, node.int_tok)
+
+  def compile_MakeStrNode(self, node):
+    return self.intrinsic(node, intrinsic_make_str, node.string_tok)
+
+  def compile_IncludeNode(self, node):
+    return self.intrinsic(node, intrinsic_include, node.include_name)
+
+  def compile_SleepNode(self, node):
+    return self.intrinsic(node, intrinsic_sleep, node.time_name)
+
+  def compile_SystemNode(self, node):
+    return self.intrinsic(node, intrinsic_system, node.system_command_name)
+
+  def compile_ShuffleNode(self, node):
+    return self.intrinsic(node, intrinsic_shuffle, node.list_name)
+
+  def compile_lenStrNode(self, node):
+    return self.intrinsic(node, intrinsic_len_str, node.string_tok)
+
+  def compile_takeElementNode(self, node):
+    return self.intrinsic(node, intrinsic_take_element, node.list_name, node.index_name)
+
+  def compile_randIntNode(self, node):
+    return self.intrinsic(node, intrinsic_rand_int, node.first_rand_name, node.second_rand_name)
+
+  def compile_ForNode(self, node):
+    var_name = node.var_name_tok.value
+    slot = node.slot
+    start_code = self.compile(node.start_value_node)
+    end_code = self.compile(node.end_value_node)
+    step_code = self.compile(node.step_value_node) if node.step_value_node else None
+    body_code = self.compile(node.body_node)
+    should_return_null = node.should_return_null
+    invariants = node.invariants
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    def code(context):
+      elements = []
+
+      start_value = start_code(context)
+      end_value = end_code(context)
+      step_value = step_code(context) if step_code else Number(1)
+
+      if invariants: reset_invariants(invariants, context)
+
+      symbol_table = context.symbol_table
+
+      for i in for_counter(start_value.value, end_value.value, step_value.value):
+        if slot is not None:
+          symbol_table.slots[slot] = make_number(i)
+        else:
+          symbol_table.set(var_name, make_number(i))
+
+        try:
+          value = body_code(context)
+        except ContinueSignal:
+          continue
+        except BreakSignal:
+          break
+
+        if not should_return_null:
+          elements.append(value)
+
+      if invariants: reset_invariants(invariants, context)
+
+      return (
+        Number.null if should_return_null else
+        List(elements).set_context(context).set_pos(pos_start, pos_end)
+      )
+    return code
+
+  def compile_WhileNode(self, node):
+    condition_code = self.compile(node.condition_node)
+    body_code = self.compile(node.body_node)
+    should_return_null = node.should_return_null
+    invariants = node.invariants
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    def code(context):
+      elements = []
+
+      if invariants: reset_invariants(invariants, context)
+
+      while condition_code(context).is_true():
+        try:
+          value = body_code(context)
+        except ContinueSignal:
+          continue
+        except BreakSignal:
+          break
+
+        if not should_return_null:
+          elements.append(value)
+
+      if invariants: reset_invariants(invariants, context)
+
+      return (
+        Number.null if should_return_null else
+        List(elements).set_context(context).set_pos(pos_start, pos_end)
+      )
+    return code
+
+  def compile_FuncDefNode(self, node):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    body_node = node.body_node
+    body_code = self.compile(body_node)
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    should_auto_return = node.should_auto_return
+    frame_layout = node.frame_layout
+    slot = node.slot
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    def code(context):
+      func_value = CompiledFunction(func_name, body_node, arg_names, should_auto_return, frame_layout, body_code).set_context(context).set_pos(pos_start, pos_end)
+
+      if slot is not None:
+        context.symbol_table.slots[slot] = func_value
+      elif func_name:
+        context.symbol_table.set(func_name, func_value)
+
+      return func_value
+    return code
+
+  def compile_CallNode(self, node, tail_call_body=None):
+    value_to_call_code = self.compile(node.node_to_call)
+    arg_codes = [self.compile(arg_node) for arg_node in node.arg_nodes]
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    def code(context):
+      value_to_call = value_to_call_code(context)
+      args = [arg_code(context) for arg_code in arg_codes]
+
+      if type(value_to_call) is CompiledFunction and value_to_call.body_node is tail_call_body:
+        raise ReturnSignal(TailCall(args, pos_start, pos_end))
+
+      res = value_to_call.call(args, context, pos_start, pos_end)
+      if res.should_return(): raise_result(res)
+      return res.value
+    return code
+
+  def compile_ReturnNode(self, node):
+    if node.tail_call_body is not None:
+      value_code = self.compile_CallNode(node.node_to_return, node.tail_call_body)
+    else:
+      value_code = self.compile(node.node_to_return) if node.node_to_return else None
+
+    def code(context):
+      raise ReturnSignal(value_code(context) if value_code else Number.null)
+    return code
+
+  def compile_ContinueNode(self, node):
+    def code(context):
+      raise ContinueSignal()
+    return code
+
+  def compile_BreakNode(self, node):
+    def code(context):
+      raise BreakSignal()
+    return code
+
+  def compile_InvariantNode(self, node):
+    value_code = self.compile(node.node)
+
+    def code(context):
+      value = invariant_value(node, context)
+      if value is None:
+        value = value_code(context)
+        keep_invariant(node, value, context)
+      return value
+    return code
+
+# bytecode mode: the AST is lowered into flat opcode and operand arrays which the VM
+# runs in a single loop, calls between hustle functions do not use the python stack
+class Bytecode:
+  def __init__(self, name, is_function=False):
+    self.name = name
+    self.is_function = is_function
+    self.ops = []
+    self.args = []
+
+  def emit(self, op, arg=None):
+    self.ops.append(op)
+    self.args.append(arg)
+    return len(self.ops) - 1
+
+  def patch(self, index, arg):
+    self.args[index] = arg
+
+  def label(self):
+    return len(self.ops)
+
+class BytecodeCompiler:
+  def compile_program(self, node):
+    code = Bytecode('<program>')
+    self.compile(node, code)
+    code.emit(OP_HALT)
+    return code
+
+  def compile_function(self, name, body_node, should_auto_return):
+    code = Bytecode(name, True)
+    self.compile(body_node, code)
+    code.emit(OP_END_FUNCTION, should_auto_return)
+    return code
+
+  def compile(self, node, code):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    method(node, code)
+
+  def no_compile_method(self, node, code):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  def intrinsic(self, node, code, intrinsic_func, *operand_nodes):
+    for operand_node in operand_nodes:
+      self.compile(operand_node, code)
+    code.emit(OP_INTRINSIC, (intrinsic_func, node, len(operand_nodes)))
+
+
+  def compile_NumberNode(self, node, code):
+    code.emit(OP_NUMBER, (node.tok.value, node.pos_start, node.pos_end))
+
+  def compile_StringNode(self, node, code):
+    code.emit(OP_STRING, node.value)
+
+  def compile_ListNode(self, node, code):
+    for element_node in node.element_nodes:
+      self.compile(element_node, code)
+    code.emit(OP_BUILD_LIST, (len(node.element_nodes), node.pos_start, node.pos_end))
+
+  def compile_VarAccessNode(self, node, code):
+    code.emit(OP_LOAD, (node.var_name_tok.value, node.depth, node.slot, node.pos_start, node.pos_end))
+
+  def compile_VarAssignNode(self, node, code):
+    self.compile(node.value_node, code)
+    code.emit(OP_STORE, (node.var_name_tok.value, node.slot))
+
+  def compile_BinOpNode(self, node, code):
+    self.compile(node.left_node, code)
+    self.compile(node.right_node, code)
+    method_name = binary_operation(node.op_tok)
+    code.emit(OP_BINARY, (method_name, NUMBER_OPERATIONS[method_name], node))
+
+  def compile_UnaryOpNode(self, node, code):
+    self.compile(node.node, code)
+    if node.op_tok.type == TT_MINUS:
+      code.emit(OP_NEGATE, node)
+    elif node.op_tok.matches(TT_KEYWORD, 'not'):
+      code.emit(OP_NOT, node)
+    else:
+      code.emit(OP_PLUS, node)
+
+  def compile_IfNode(self, node, code):
+    end_jumps = []
+
+    for condition, expr, should_return_null in node.cases:
+      self.compile(condition, code)
+      next_case = code.emit(OP_JUMP_IF_FALSE)
+      self.compile(expr, code)
+      if should_return_null:
+        code.emit(OP_POP)
+        code.emit(OP_NULL)
+      end_jumps.append(code.emit(OP_JUMP))
+      code.patch(next_case, code.label())
+
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      self.compile(expr, code)
+      if should_return_null:
+        code.emit(OP_POP)
+        code.emit(OP_NULL)
+    else:
+      code.emit(OP_NULL)
+
+    for end_jump in end_jumps:
+      code.patch(end_jump, code.label())
+
+  def compile_ArgvNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_argv, node.argv_count)
+
+  def compile_ExitNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_exit, node.exit_code)
+
+  def compile_MakeFloatNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_make_float, node.float_tok)
+
+  def compile_MakeIntNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_make_int, node.int_tok)
+
+  def compile_MakeStrNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_make_str, node.string_tok)
+
+  def compile_IncludeNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_include, node.include_name)
+
+  def compile_SleepNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_sleep, node.time_name)
+
+  def compile_SystemNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_system, node.system_command_name)
+
+  def compile_ShuffleNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_shuffle, node.list_name)
+
+  def compile_lenStrNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_len_str, node.string_tok)
+
+  def compile_takeElementNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_take_element, node.list_name, node.index_name)
+
+  def compile_randIntNode(self, node, code):
+    self.intrinsic(node, code, intrinsic_rand_int, node.first_rand_name, node.second_rand_name)
+
+  def compile_ForNode(self, node, code):
+    self.compile(node.start_value_node, code)
+    self.compile(node.end_value_node, code)
+    if node.step_value_node:
+      self.compile(node.step_value_node, code)
+
+    setup = code.emit(OP_SETUP_FOR)
+    loop_start = code.label()
+    for_iter = code.emit(OP_FOR_ITER)
+    self.compile(node.body_node, code)
+    code.emit(OP_POP if node.should_return_null else OP_LOOP_APPEND)
+    code.emit(OP_JUMP, loop_start)
+
+    loop_end = code.emit(OP_END_FOR, (node.should_return_null, node.invariants, node.pos_start, node.pos_end))
+    code.patch(setup, (node.step_value_node is not None, node.invariants, loop_start, loop_end))
+    code.patch(for_iter, (node.var_name_tok.value, node.slot, loop_end))
+
+  def compile_WhileNode(self, node, code):
+    setup = code.emit(OP_SETUP_WHILE)
+    loop_start = code.label()
+    self.compile(node.condition_node, code)
+    exit_jump = code.emit(OP_JUMP_IF_FALSE)
+    self.compile(node.body_node, code)
+    code.emit(OP_POP if node.should_return_null else OP_LOOP_APPEND)
+    code.emit(OP_JUMP, loop_start)
+
+    loop_end = code.emit(OP_END_WHILE, (node.should_return_null, node.invariants, node.pos_start, node.pos_end))
+    code.patch(setup, (node.invariants, loop_start, loop_end))
+    code.patch(exit_jump, loop_end)
+
+  def compile_FuncDefNode(self, node, code):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    body_code = self.compile_function(func_name or "<anonymous>", node.body_node, node.should_auto_return)
+    code.emit(OP_MAKE_FUNCTION, (func_name, node.slot, node.body_node, arg_names, node.should_auto_return, node.frame_layout, body_code, node.pos_start, node.pos_end))
+
+  def compile_CallNode(self, node, code):
+    self.compile(node.node_to_call, code)
+    for arg_node in node.arg_nodes:
+      self.compile(arg_node, code)
+    code.emit(OP_CALL, (len(node.arg_nodes), node.pos_start, node.pos_end))
+
+  def compile_ReturnNode(self, node, code):
+    if node.tail_call_body is not None:
+      call_node = node.node_to_return
+      self.compile(call_node.node_to_call, code)
+      for arg_node in call_node.arg_nodes:
+        self.compile(arg_node, code)
+      code.emit(OP_TAIL_CALL, (len(call_node.arg_nodes), call_node.pos_start, call_node.pos_end))
+    elif node.node_to_return:
+      self.compile(node.node_to_return, code)
+    else:
+      code.emit(OP_NULL)
+    code.emit(OP_RETURN)
+
+  def compile_ContinueNode(self, node, code):
+    code.emit(OP_CONTINUE)
+
+  def compile_BreakNode(self, node, code):
+    code.emit(OP_BREAK)
+
+  def compile_InvariantNode(self, node, code):
+    load = code.emit(OP_LOAD_INVARIANT)
+    self.compile(node.node, code)
+    code.emit(OP_KEEP_INVARIANT, node)
+    code.patch(load, (node, code.label()))
+
+class Frame:
+  def __init__(self, code, context, base=0, function=None):
+    self.code = code
+    self.context = context
+    self.base = base
+    # the VMFunction running in this frame, it gets the context back when the call returns
+    self.function = function
+    self.ip = 0
+    # every running loop has a block [continue target, break target, stack height, elements, counter]
+    self.blocks = []
+
+class VM:
+  def run(self, code, context):
+    return self.execute(Frame(code, context))
+
+  def execute(self, frame):
+    stack = []
+    frames = []
+
+    ops = frame.code.ops
+    args = frame.code.args
+    context = frame.context
+    blocks = frame.blocks
+    ip = 0
+
+    while True:
+      op = ops[ip]
+      arg = args[ip]
+      ip += 1
+
+      if op == OP_LOAD:
+        var_name, depth, slot, pos_start, pos_end = arg
+
+        if depth == 0:
+          value = context.symbol_table.get_slot(slot, var_name)
+        elif depth == 1:
+          value = context.symbol_table.get_parent(var_name)
+        else:
+          value = context.symbol_table.get(var_name)
+
+        if not value:
+          return RTResult().failure(RTError(
+            pos_start, pos_end,
+            f"'{var_name}' is not defined",
+            context
+          ))
+
+        stack.append(value)
+
+      elif op == OP_NUMBER:
+        value, pos_start, pos_end = arg
+        stack.append(Number(value).set_context(context).set_pos(pos_start, pos_end))
+
+      elif op == OP_BINARY:
+        method_name, number_operation, node = arg
+        right = stack.pop()
+        left = stack.pop()
+
+        if type(left) is Number and type(right) is Number:
+          result = number_operation(left.value, right.value)
+          if result is not None:
+            stack.append(result)
+            continue
+
+        result, error = getattr(left, method_name)(right)
+        if error: return RTResult().failure(operation_error(method_name, left, right, node, context))
+        stack.append(result)
+
+      elif op == OP_LOAD_INVARIANT:
+        node, skip = arg
+        value = invariant_value(node, context)
+        if value is not None:
+          stack.append(value)
+          ip = skip
+
+      elif op == OP_KEEP_INVARIANT:
+        keep_invariant(arg, stack[-1], context)
+
+      elif op == OP_STORE:
+        var_name, slot = arg
+        if slot is not None:
+          context.symbol_table.slots[slot] = stack[-1]
+        else:
+          context.symbol_table.set(var_name, stack[-1])
+
+      elif op == OP_POP:
+        stack.pop()
+
+      elif op == OP_JUMP_IF_FALSE:
+        if not stack.pop().is_true():
+          ip = arg
+
+      elif op == OP_JUMP:
+        ip = arg
+
+      elif op == OP_LOOP_APPEND:
+        blocks[-1][3].append(stack.pop())
+
+      elif op == OP_FOR_ITER:
+        var_name, slot, loop_end = arg
+        i = next(blocks[-1][4], None)
+
+        if i is not None:
+          if slot is not None:
+            context.symbol_table.slots[slot] = make_number(i)
+          else:
+            context.symbol_table.set(var_name, make_number(i))
+        else:
+          ip = loop_end
+
+      elif op == OP_CALL or op == OP_TAIL_CALL:
+        argc, pos_start, pos_end = arg
+        call_args = stack[len(stack) - argc:]
+        del stack[len(stack) - argc:]
+        value_to_call = stack.pop()
+
+        if isinstance(value_to_call, VMFunction):
+          if len(call_args) != value_to_call.arity:
+            return RTResult().failure(value_to_call.arity_error(call_args, context, pos_start, pos_end))
+
+          if op == OP_TAIL_CALL and value_to_call.code is frame.code:
+            # the body runs again in this frame, see TailCall
+            value_to_call.populate_frame(call_args, context)
+            del stack[frame.base:]
+            del blocks[:]
+            ip = 0
+            continue
+
+          exec_ctx = value_to_call.enter_frame(call_args, context, pos_start)
+
+          frame.ip = ip
+          frames.append(frame)
+          frame = Frame(value_to_call.code, exec_ctx, len(stack), value_to_call)
+          ops = frame.code.ops
+          args = frame.code.args
+          context = exec_ctx
+          blocks = frame.blocks
+          ip = 0
+        else:
+          res = value_to_call.call(call_args, context, pos_start, pos_end)
+          if res.should_return(): return res
+          stack.append(res.value)
+
+      elif op == OP_RETURN or op == OP_END_FUNCTION:
+        value = stack.pop()
+        if op == OP_END_FUNCTION and not arg:
+          value = Number.null
+
+        if frame.function:
+          frame.function.leave_frame(context)
+
+        if not frames:
+          if frame.code.is_function:
+            return RTResult().success(value)
+          return RTResult().success_return(value)
+
+        del stack[frame.base:]
+        frame = frames.pop()
+        ops = frame.code.ops
+        args = frame.code.args
+        context = frame.context
+        blocks = frame.blocks
+        ip = frame.ip
+        stack.append(value)
+
+      elif op == OP_STRING:
+        stack.append(arg)
+
+      elif op == OP_NULL:
+        stack.append(Number.null)
+
+      elif op == OP_BUILD_LIST:
+        count, pos_start, pos_end = arg
+        elements = stack[len(stack) - count:]
+        del stack[len(stack) - count:]
+        stack.append(List(elements).set_context(context).set_pos(pos_start, pos_end))
+
+      elif op == OP_NEGATE or op == OP_NOT or op == OP_PLUS:
+        number = stack.pop()
+        result, error = number, None
+
+        if op == OP_NEGATE:
+          result, error = number.multed_by(Number(-1))
+        elif op == OP_NOT:
+          result, error = number.notted()
+
+        if error: return RTResult().failure(unary_operation_error(arg, number, context))
+        stack.append(result)
+
+      elif op == OP_SETUP_FOR:
+        has_step, invariants, loop_start, loop_end = arg
+        step_value = stack.pop() if has_step else Number(1)
+        end_value = stack.pop()
+        start_value = stack.pop()
+        if invariants: reset_invariants(invariants, context)
+        blocks.append([loop_start, loop_end, len(stack), [], iter(for_counter(start_value.value, end_value.value, step_value.value))])
+
+      elif op == OP_SETUP_WHILE:
+        invariants, loop_start, loop_end = arg
+        if invariants: reset_invariants(invariants, context)
+        blocks.append([loop_start, loop_end, len(stack), [], None])
+
+      elif op == OP_END_FOR or op == OP_END_WHILE:
+        should_return_null, invariants, pos_start, pos_end = arg
+        elements = blocks.pop()[3]
+        if invariants: reset_invariants(invariants, context)
+        stack.append(
+          Number.null if should_return_null else
+          List(elements).set_context(context).set_pos(pos_start, pos_end)
+        )
+
+      elif op == OP_CONTINUE or op == OP_BREAK:
+        # like the tree interpreter a continue or break outside of a loop leaves the
+        # function and continues or breaks the loop of the caller
+        while not blocks:
+          if not frames:
+            return RTResult().success_continue() if op == OP_CONTINUE else RTResult().success_break()
+
+          del stack[frame.base:]
+          frame = frames.pop()
+          ops = frame.code.ops
+          args = frame.code.args
+          context = frame.context
+          blocks = frame.blocks
+
+        block = blocks[-1]
+        del stack[block[2]:]
+        ip = block[0] if op == OP_CONTINUE else block[1]
+
+      elif op == OP_INTRINSIC:
+        intrinsic_func, node, argc = arg
+        operands = stack[len(stack) - argc:]
+        del stack[len(stack) - argc:]
+        stack.append(intrinsic_func(node, context, *operands))
+
+      elif op == OP_MAKE_FUNCTION:
+        func_name, slot, body_node, arg_names, should_auto_return, frame_layout, body_code, pos_start, pos_end = arg
+        func_value = VMFunction(func_name, body_node, arg_names, should_auto_return, frame_layout, body_code).set_context(context).set_pos(pos_start, pos_end)
+
+        if slot is not None:
+          context.symbol_table.slots[slot] = func_value
+        elif func_name:
+          context.symbol_table.set(func_name, func_value)
+
+        stack.append(func_value)
+
+      elif op == OP_HALT:
+        return RTResult().success(stack.pop())
+
+      else:
+        raise Exception(f'Unknown opcode {op}')
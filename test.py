@@ -9,6 +9,7 @@ from typing import List, BinaryIO, Tuple, Optional
 from dataclasses import dataclass, field
 
 HUSTLE_EXT = '.hsle'
+HUSTLE_ENGINES = ['tree', 'closure', 'vm']
 
 # Thanks to tsoding, for this code that I did not want to write as I am lazy
 # his langauage:- https://gitlab.com/tsoding/porth
@@ -85,7 +86,7 @@ class RunStats:
     ignored: int = 0
     failed_files: List[str] = field(default_factory=list)
 
-def run_test_for_file(file_path: str, stats: RunStats = RunStats()):
+def run_test_for_file(file_path: str, stats: RunStats = RunStats(), engine: str = 'tree'):
     assert path.isfile(file_path)
     assert file_path.endswith(HUSTLE_EXT)
 
@@ -98,7 +99,7 @@ def run_test_for_file(file_path: str, stats: RunStats = RunStats()):
 
     if tc is not None:
         # TODO: do something about fasm splash output
-        com = cmd_run_echoed(["./hustle.py", "run", file_path, *tc.argv], input=tc.stdin, capture_output=True)
+        com = cmd_run_echoed(["./hustle.py", "run", "--engine=%s" % engine, file_path, *tc.argv], input=tc.stdin, capture_output=True)
         if com.returncode != tc.returncode or com.stdout != tc.stdout or com.stderr != tc.stderr:
             print("[ERROR] Unexpected output")
             print("  Expected:")
@@ -114,7 +115,7 @@ def run_test_for_file(file_path: str, stats: RunStats = RunStats()):
 
     else:
         print('[WARNING] Could not find any input/output data for %s. Ignoring testing. Only checking if it runs.' % file_path)
-        com = cmd_run_echoed(["./hustle.py", "run", file_path])
+        com = cmd_run_echoed(["./hustle.py", "run", "--engine=%s" % engine, file_path])
         if com.returncode != 0:
             error = True
             stats.failed += 1
@@ -123,11 +124,11 @@ def run_test_for_file(file_path: str, stats: RunStats = RunStats()):
     if error:
         stats.failed_files.append(file_path)
 
-def run_test_for_folder(folder: str):
+def run_test_for_folder(folder: str, engine: str = 'tree'):
     stats = RunStats()
     for entry in os.scandir(folder):
         if entry.is_file() and entry.path.endswith(HUSTLE_EXT):
-            run_test_for_file(entry.path, stats)
+            run_test_for_file(entry.path, stats, engine)
     print()
     print("Failed: %d, Ignored: %d" % (stats.failed, stats.ignored))
     if stats.failed != 0:
@@ -171,9 +172,10 @@ def usage(exe_name: str):
     print("  Run or update the tests. The default [SUBCOMMAND] is 'run'.")
     print()
     print("  SUBCOMMAND:")
-    print("    run [TARGET]")
+    print("    run [--engine=ENGINE] [TARGET]")
     print("      Run the test on the [TARGET]. The [TARGET] is either a *.hsle file or ")
     print("      folder with *.hsle files. The default [TARGET] is './tests/'.")
+    print("      The [ENGINE] is one of %s. The default [ENGINE] is 'tree'." % ", ".join(HUSTLE_ENGINES))
     print()
     print("    update [SUBSUBCOMMAND]")
     print("      Update the input or output of the tests.")
@@ -233,21 +235,27 @@ if __name__ == '__main__':
             exit(1)
     elif subcommand == 'run' or subcommand == 'test':
         target = './tests/'
+        engine = 'tree'
+
+        if len(argv) > 0 and argv[0].startswith('--engine='):
+            engine = argv[0][len('--engine='):]
+            argv = argv[1:]
 
         if len(argv) > 0:
             target, *argv = argv
 
         if path.isdir(target):
-            run_test_for_folder(target)
+            run_test_for_folder(target, engine)
         elif path.isfile(target):
-            run_test_for_file(target)
+            run_test_for_file(target, engine=engine)
         else:
             # TODO: `./test.py run non-existing-file` fails with 'unreachable'
             assert False, 'unreachable'
     elif subcommand == 'full' or subcommand == 'all':
         cmd_run_echoed(['mypy', './test.py'])
-        run_test_for_folder('./tests/')
-        run_test_for_folder('./examples/')
+        for engine in HUSTLE_ENGINES:
+            run_test_for_folder('./tests/', engine)
+            run_test_for_folder('./examples/', engine)
     elif subcommand == 'help':
         usage(exe_name)
     else: